@@ -1,13 +1,13 @@
 import os
 import os.path as osp
-from collections import Counter
 
 from pipelib import TextDataset
 from pipelib.serializers import save_pipeline, load_pipeline
 
 
-def build_vocab(tokens):
-    counter = Counter(tokens)
+def build_vocab(lines):
+    # lines are split into tokens in the workers, so only lines are sent
+    counter = lines.count_by_parallel(str.split, chunksize=8192, flat=True)
     words, _ = zip(*counter.most_common())
     return dict(zip(words, range(len(words))))
 
@@ -23,7 +23,7 @@ if __name__ == '__main__':
     en_test = TextDataset('test.en')
 
     # build vocabulary
-    token_to_index = build_vocab(en_train.concat(en_test).map(str.split).flat_map(lambda x: x))
+    token_to_index = build_vocab(en_train.concat(en_test))
 
     # process training data
     en_train = en_train.map(str.split).map(lambda x: [token_to_index[token] for token in x])
@@ -1 +1,2 @@
 from pipelib.core import Dataset, TextDataset, DirDataset
+from pipelib.core import INFINITE, UNKNOWN, AUTOTUNE
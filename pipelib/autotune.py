@@ -0,0 +1,80 @@
+import os
+import sys
+import threading
+
+
+AUTOTUNE = 'autotune'
+
+MEMORY_LIMIT = 1 << 28
+
+
+class Budget:
+    def __init__(self, size):
+        self._size = size
+        self._lock = threading.Lock()
+
+    def acquire(self):
+        with self._lock:
+            if self._size <= 0:
+                return False
+            self._size -= 1
+            return True
+
+    def release(self, n=1):
+        with self._lock:
+            self._size += n
+
+
+# the CPU cores shared by the autotuned parallel stages of this process
+cpu_budget = Budget(os.cpu_count() or 1)
+
+
+class ParallelismTuner:
+    # A stage starts with one task in flight and takes a core from the
+    # budget whenever its consumer has to wait for a result. It gives cores
+    # back while its results queue up unconsumed, so that they go to the
+    # stages that are the bottleneck.
+    def __init__(self, limit=None, budget=cpu_budget):
+        self.parallelism = 1
+        self._limit = limit or os.cpu_count() or 1
+        self._budget = budget
+        # a stage still runs its first task when the budget is exhausted,
+        # but only the cores it actually took are given back
+        self._held = int(budget.acquire())
+
+    @property
+    def max_pending(self):
+        return 2 * self.parallelism
+
+    def record(self, waited, n_ready):
+        if waited:
+            if self.parallelism < self._limit and self._budget.acquire():
+                self.parallelism += 1
+                self._held += 1
+        elif n_ready > self.parallelism and self.parallelism > 1:
+            self.parallelism -= 1
+            self._held -= 1
+            self._budget.release()
+
+    def close(self):
+        self._budget.release(self._held)
+        self._held = 0
+        self.parallelism = 1
+
+
+class BufferTuner:
+    # A prefetch buffer doubles whenever its consumer finds it empty, as
+    # long as the estimated size of a full buffer stays within the limit.
+    def __init__(self, memory_limit=None):
+        self.size = 1
+        self._memory_limit = memory_limit or MEMORY_LIMIT
+        self._item_size = 0
+
+    def record(self, waited, x):
+        # a running average of the shallow element size
+        size = sys.getsizeof(x)
+        if self._item_size:
+            size = self._item_size + (size - self._item_size) / 8
+        self._item_size = size
+        if waited and 2 * self.size * self._item_size <= self._memory_limit:
+            self.size *= 2
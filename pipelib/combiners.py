@@ -0,0 +1,116 @@
+import copy
+from abc import ABC, abstractmethod
+from functools import reduce
+from itertools import chain
+from collections import Counter
+
+
+class Combiner(ABC):
+    @abstractmethod
+    def create(self):
+        pass
+
+    @abstractmethod
+    def add(self, accumulator, x):
+        pass
+
+    @abstractmethod
+    def merge(self, accumulator, other):
+        pass
+
+    def add_all(self, accumulator, iterable):
+        for x in iterable:
+            accumulator = self.add(accumulator, x)
+        return accumulator
+
+    def result(self, accumulator):
+        return accumulator
+
+
+_EMPTY = object()
+
+
+class Reduce(Combiner):
+    # Parallel form of functools.reduce(func, iterable, init). Partials are
+    # built per chunk and merged, and init is applied once to the merged
+    # result. Without combine, func must be associative on the elements
+    # themselves (e.g. operator.add on numbers) and also merges partials.
+    # When the accumulator type differs from the elements, combine merges
+    # two accumulators and identity is the empty accumulator.
+    __slots__ = ['_func', '_init', '_combine', '_identity']
+
+    def __init__(self, func, init, combine=None, identity=None):
+        if combine is not None and identity is None:
+            raise ValueError('identity is required when combine is given')
+        self._func = func
+        self._init = init
+        self._combine = combine or func
+        self._identity = _EMPTY if combine is None else identity
+
+    def create(self):
+        # every partial gets its own copy, as func and combine may update
+        # the accumulator in place
+        if self._identity is _EMPTY:
+            return _EMPTY
+        return copy.deepcopy(self._identity)
+
+    def add(self, accumulator, x):
+        if accumulator is _EMPTY:
+            return x
+        return self._func(accumulator, x)
+
+    def merge(self, accumulator, other):
+        if accumulator is _EMPTY:
+            return other
+        if other is _EMPTY:
+            return accumulator
+        return self._combine(accumulator, other)
+
+    def add_all(self, accumulator, iterable):
+        iterator = iter(iterable)
+        if accumulator is _EMPTY:
+            accumulator = next(iterator, _EMPTY)
+            if accumulator is _EMPTY:
+                return _EMPTY
+        return reduce(self._func, iterator, accumulator)
+
+    def result(self, accumulator):
+        if accumulator is _EMPTY:
+            return copy.deepcopy(self._init)
+        return self._combine(copy.deepcopy(self._init), accumulator)
+
+
+class CountBy(Combiner):
+    # With flat=True, key returns several keys per element (e.g. str.split
+    # for tokens of a line), so that the expansion runs where the counting
+    # does rather than in the process feeding the elements.
+    __slots__ = ['_key', '_flat']
+
+    def __init__(self, key=None, flat=False):
+        if flat and key is None:
+            raise ValueError('key is required when flat is set')
+        self._key = key
+        self._flat = flat
+
+    def create(self):
+        return Counter()
+
+    def add(self, accumulator, x):
+        if self._flat:
+            accumulator.update(self._key(x))
+        else:
+            accumulator[x if self._key is None else self._key(x)] += 1
+        return accumulator
+
+    def merge(self, accumulator, other):
+        accumulator.update(other)
+        return accumulator
+
+    def add_all(self, accumulator, iterable):
+        if self._key is None:
+            accumulator.update(iterable)
+        elif self._flat:
+            accumulator.update(chain.from_iterable(map(self._key, iterable)))
+        else:
+            accumulator.update(map(self._key, iterable))
+        return accumulator
@@ -1,11 +1,22 @@
+import os
+import codecs
 import random
-import pickle
-from pathlib import Path
+import operator
+from array import array
+from functools import reduce
 from itertools import chain, islice, tee
 from collections import deque
+from collections.abc import Sized
 
-from pipelib import parallel
+from pipelib import combiners
 from pipelib import iterators
+from pipelib.autotune import AUTOTUNE  # NOQA
+
+# parallel (multiprocess and dill), serializers (cloudpickle), sorting and
+# dedup are imported on first use to keep `import pipelib` cheap
+
+INFINITE = -1
+UNKNOWN = -2
 
 
 class Dataset:
@@ -18,23 +29,73 @@ class Dataset:
     def __iter__(self):
         yield from self._dataset
 
-    def get_prefetch_iterator(self, n_prefetch=1):
-        return iterators.PrefetchIterator(self, n_prefetch)
+    def __len__(self):
+        n = self.cardinality()
+        if n == INFINITE:
+            raise TypeError('dataset is infinite')
+        if n == UNKNOWN:
+            raise TypeError('dataset length is unknown')
+        return n
+
+    def __bool__(self):
+        # datasets are truthy regardless of their (possibly unknown) length
+        return True
+
+    def __getitem__(self, index):
+        return self._dataset[_check_index(index)]
+
+    def cardinality(self):
+        dataset = self._dataset
+        if hasattr(dataset, 'cardinality'):
+            return dataset.cardinality()
+        if isinstance(dataset, Sized):
+            return len(dataset)
+        return UNKNOWN
+
+    def get_prefetch_iterator(self, n_prefetch=1, memory_limit=None):
+        return iterators.PrefetchIterator(self, n_prefetch, memory_limit)
+
+    def get_resumable_iterator(self, state=None):
+        iterator = self._get_resumable_iterator()
+        if state is not None:
+            iterator.set_state(state)
+        return iterator
+
+    def _get_resumable_iterator(self):
+        return iterators.get_resumable_iterator(self._dataset)
 
     def apply(self, func):
         return PipelinedDataset(self, func)
 
     def repeat(self):
         def f(dataset):
-            while True:
-                yield from dataset
-        return PipelinedDataset(self, f)
+            # an empty epoch means the source is empty; stop instead of
+            # spinning forever
+            empty = False
+            while not empty:
+                empty = True
+                for x in dataset:
+                    empty = False
+                    yield x
+
+        def h(n):
+            # an unknown source is taken to be non-empty; if it is empty
+            # after all, f stops after the first epoch
+            return 0 if n == 0 else INFINITE
+        return PipelinedDataset(
+            self, _Operation(f, iterators.RepeatIterator, h))
 
     def batch(self, batch_size):
         def f(dataset):
             iterator = iter(dataset)
             yield from iter(lambda: list(islice(iterator, batch_size)), [])
-        return PipelinedDataset(self, f)
+
+        def g(iterator):
+            return iterators.BatchIterator(iterator, batch_size)
+
+        def h(n):
+            return n if n < 0 else -(-n // batch_size)
+        return PipelinedDataset(self, _Operation(f, g, h))
 
     def shuffle(self, shuffle_size):
         def f(dataset):
@@ -42,56 +103,186 @@ class Dataset:
             for chunk in iter(lambda: list(islice(iterator, shuffle_size)), []):
                 random.shuffle(chunk)
                 yield from chunk
-        return PipelinedDataset(self, f)
+
+        def g(iterator):
+            return iterators.ShuffleIterator(iterator, shuffle_size)
+        return PipelinedDataset(self, _Operation(f, g, _same_cardinality))
 
     def window(self, window_size):
         def f(dataset):
             yield from zip(*(deque(islice(it, i), 0) or it
                              for i, it in enumerate(tee(dataset, window_size))))
-        return PipelinedDataset(self, f)
+
+        def g(iterator):
+            return iterators.WindowIterator(iterator, window_size)
+
+        def h(n):
+            return n if n < 0 else max(n - window_size + 1, 0)
+        return PipelinedDataset(self, _Operation(f, g, h))
 
     def map(self, map_func):
         def f(dataset):
             return map(map_func, dataset)
-        return PipelinedDataset(self, f)
+
+        def g(iterator):
+            return iterators.MapIterator(iterator, map_func)
+        return PipelinedDataset(
+            self, _Operation(f, g, _same_cardinality, map_func))
 
     def flat_map(self, map_func):
         def f(dataset):
             return chain.from_iterable(map(map_func, dataset))
-        return PipelinedDataset(self, f)
+
+        def g(iterator):
+            return iterators.FlatMapIterator(iterator, map_func)
+        return PipelinedDataset(self, _Operation(f, g, _unknown_cardinality))
 
     def filter(self, predicate):
         def f(dataset):
             return filter(predicate, dataset)
-        return PipelinedDataset(self, f)
 
-    def zip(self, *others):
+        def g(iterator):
+            return iterators.FilterIterator(iterator, predicate)
+        return PipelinedDataset(self, _Operation(f, g, _unknown_cardinality))
+
+    def zip(self, *others, n_prefetch=0):
         assert all(isinstance(other, Dataset) for other in others)
 
         def f(dataset):
-            yield from zip(dataset, *others)
-        return PipelinedDataset(self, f)
-
-    def concat(self, *others):
+            if not n_prefetch:
+                yield from zip(dataset, *others)
+                return
+
+            # every input is read ahead in its own thread, so the slowest
+            # one sets the pace instead of the sum of them
+            inputs = [iterators.PrefetchIterator(x, n_prefetch)
+                      for x in (dataset, *others)]
+            try:
+                yield from zip(*inputs)
+            finally:
+                for x in inputs:
+                    x.close()
+
+        def g(iterator):
+            return iterators.ZipIterator(
+                iterator, *map(iterators.get_resumable_iterator, others))
+
+        def h(n):
+            ns = [n, *(other.cardinality() for other in others)]
+            if 0 in ns:
+                return 0
+            if UNKNOWN in ns:
+                return UNKNOWN
+            return min((n for n in ns if n >= 0), default=INFINITE)
+        return PipelinedDataset(self, _Operation(f, g, h))
+
+    def concat(self, *others, n_prefetch=0):
         assert all(isinstance(other, Dataset) for other in others)
 
         def f(dataset):
-            yield from chain(dataset, *others)
+            if not n_prefetch:
+                yield from chain(dataset, *others)
+                return
+
+            # the next input is opened and read ahead while the current one
+            # is consumed
+            inputs = deque()
+            try:
+                for x in (dataset, *others):
+                    inputs.append(iterators.PrefetchIterator(x, n_prefetch))
+                    if len(inputs) == 2:
+                        yield from inputs[0]
+                        inputs.popleft()
+                while inputs:
+                    yield from inputs[0]
+                    inputs.popleft()
+            finally:
+                for x in inputs:
+                    x.close()
+
+        def g(iterator):
+            return iterators.ChainIterator(
+                iterator, *map(iterators.get_resumable_iterator, others))
+
+        def h(n):
+            return _sum_cardinality(
+                [n, *(other.cardinality() for other in others)])
+        return PipelinedDataset(self, _Operation(f, g, h))
+
+    def sort_by(self, key, reverse=False, memory_limit=None):
+        from pipelib import sorting
+
+        def f(dataset):
+            return sorting.external_sort(dataset, key, reverse, memory_limit)
+        return PipelinedDataset(
+            self, _Operation(f, cardinality=_same_cardinality))
+
+    def distinct(self, key=None, exact=True, error_rate=0.001, capacity=1024):
+        from pipelib import dedup
+
+        def f(dataset):
+            seen = dedup.get_seen_set(exact, error_rate, capacity)
+            return dedup.distinct(dataset, key, seen)
         return PipelinedDataset(self, f)
 
     def map_parallel(self, map_func, n=None, chunksize=1, unordered=False):
+        from pipelib import parallel
+
         return PipelinedDataset(
             self, parallel.MapParallel(map_func, n, chunksize, unordered))
 
     def flat_map_parallel(self, map_func, n=None, chunksize=1, unordered=False):
+        from pipelib import parallel
+
         return PipelinedDataset(
             self, parallel.FlatMapParallel(map_func, n, chunksize, unordered))
 
     def filter_parallel(self, predicate, n=None, chunksize=1, unordered=False):
+        from pipelib import parallel
+
         return PipelinedDataset(
             self, parallel.FilterParallel(predicate, n, chunksize, unordered))
 
+    def batch_parallel(self, batch_size, n=None, n_prefetch=2, collate=None,
+                       shuffle=False, drop_last=False):
+        from pipelib import parallel
+
+        return Dataset(parallel.BatchLoader(
+            self, batch_size, n, n_prefetch, collate, shuffle, drop_last))
+
+    def stage(self, n_prefetch=1, chunksize=1):
+        from pipelib import parallel
+
+        # everything up to here runs in a separate process
+        return Dataset(parallel.Stage(self, n_prefetch, chunksize))
+
+    def aggregate(self, combiner):
+        return combiner.result(combiner.add_all(combiner.create(), self))
+
+    def reduce(self, func, init):
+        return reduce(func, self, init)
+
+    def count_by(self, key=None, flat=False):
+        return self.aggregate(combiners.CountBy(key, flat))
+
+    def aggregate_parallel(self, combiner, n=None, chunksize=1024):
+        from pipelib import parallel
+
+        return parallel.AggregateParallel(combiner, n, chunksize)(self)
+
+    def reduce_parallel(self, func, init, combine=None, identity=None, n=None,
+                        chunksize=1024):
+        return self.aggregate_parallel(
+            combiners.Reduce(func, init, combine, identity), n, chunksize)
+
+    def count_by_parallel(self, key=None, n=None, chunksize=1024, flat=False):
+        return self.aggregate_parallel(
+            combiners.CountBy(key, flat), n, chunksize)
+
     def all(self):
+        if self.cardinality() == INFINITE:
+            raise ValueError('cannot materialize an infinite dataset')
+        # list() preallocates from __len__ when the cardinality is known
         return list(self)
 
     def take(self, n):
@@ -101,16 +292,117 @@ class Dataset:
         return next(iter(self))
 
     def save(self, filename):
-        cache = list(self)
-        with open(filename, 'wb') as f:
-            pickle.dump(cache, f)
+        from pipelib import serializers
+
+        cache = self.all()
+        serializers.dump(cache, filename)
         return CacheDataset(self, cache)
 
     @staticmethod
     def load(filename):
-        with open(filename, 'rb') as f:
-            dataset = pickle.load(f)
-        return Dataset(dataset)
+        from pipelib import serializers
+
+        return Dataset(serializers.load(filename))
+
+    @staticmethod
+    def sample_from(datasets, weights=None, seed=None, n_prefetch=0):
+        from pipelib import sampling
+
+        # exhausted datasets drop out of the mixture until all are done
+        datasets = list(datasets)
+        assert all(isinstance(d, Dataset) for d in datasets)
+        if weights is not None:
+            weights = list(weights)
+
+        def k():
+            return _sum_cardinality([
+                d.cardinality() for i, d in enumerate(datasets)
+                if weights is None or weights[i]])
+        return Dataset(_Repeated(
+            sampling.sample_from, datasets, weights, seed, n_prefetch,
+            cardinality=k))
+
+
+class _Operation:
+    __slots__ = ['_func', '_resumable', '_cardinality', '_elementwise']
+
+    def __init__(self, func, resumable=None, cardinality=None,
+                 elementwise=None):
+        self._func = func
+        self._resumable = resumable
+        self._cardinality = cardinality
+        # the function applied to each element, for one-to-one operations
+        # that preserve random access
+        self._elementwise = elementwise
+
+    def __call__(self, dataset):
+        return self._func(dataset)
+
+    def resumable(self, iterator):
+        if self._resumable is None:
+            raise TypeError(
+                f'{self._func!r} does not support resumable iteration')
+        return self._resumable(iterator)
+
+    def cardinality(self, n):
+        if self._cardinality is None:
+            return _unknown_cardinality(n)
+        return self._cardinality(n)
+
+    def elementwise(self, x):
+        if self._elementwise is None:
+            raise TypeError(
+                f'{self._func!r} does not support random access')
+        return self._elementwise(x)
+
+
+def _identity(dataset):
+    return dataset
+
+
+def _same_cardinality(n):
+    return n
+
+
+def _unknown_cardinality(n):
+    return 0 if n == 0 else UNKNOWN
+
+
+def _check_index(index):
+    # element-wise operations apply to single elements, so slices and other
+    # keys are rejected rather than passed through them
+    try:
+        return operator.index(index)
+    except TypeError:
+        raise TypeError(f'dataset indices must be integers, '
+                        f'not {type(index).__name__}') from None
+
+
+def _sum_cardinality(ns):
+    if INFINITE in ns:
+        return INFINITE
+    if UNKNOWN in ns:
+        return UNKNOWN
+    return sum(ns)
+
+
+def _get_resumable_func(func):
+    try:
+        return func.resumable
+    except AttributeError:
+        raise TypeError(
+            f'{func!r} does not support resumable iteration') from None
+
+
+def _get_cardinality_func(func):
+    return getattr(func, 'cardinality', None) or _unknown_cardinality
+
+
+def _get_elementwise_func(func):
+    elementwise = getattr(func, 'elementwise', None)
+    if elementwise is None:
+        raise TypeError(f'{func!r} does not support random access')
+    return elementwise
 
 
 class _NestedFunc:
@@ -132,6 +424,21 @@ class _NestedFunc:
             dataset = func(dataset)
         return dataset
 
+    def resumable(self, iterator):
+        for func in self._flatten_func(self):
+            iterator = _get_resumable_func(func)(iterator)
+        return iterator
+
+    def cardinality(self, n):
+        for func in self._flatten_func(self):
+            n = _get_cardinality_func(func)(n)
+        return n
+
+    def elementwise(self, x):
+        for func in self._flatten_func(self):
+            x = _get_elementwise_func(func)(x)
+        return x
+
 
 class PipelinedDataset(Dataset):
 
@@ -146,57 +453,214 @@ class PipelinedDataset(Dataset):
     def __iter__(self):
         yield from self._func(self._dataset)
 
+    def _get_resumable_iterator(self):
+        return _get_resumable_func(self._func)(super()._get_resumable_iterator())
+
+    def cardinality(self):
+        return _get_cardinality_func(self._func)(super().cardinality())
+
+    def __getitem__(self, index):
+        return _get_elementwise_func(self._func)(super().__getitem__(index))
+
 
 class CacheDataset(PipelinedDataset):
 
     def __init__(self, dataset, cache):
-        super().__init__(dataset, lambda x: x)
+        super().__init__(
+            dataset,
+            _Operation(_identity, _identity, _same_cardinality, _identity))
         self._cache = cache
 
     def __iter__(self):
         yield from self._cache
 
+    def cardinality(self):
+        return len(self._cache)
+
+    def __getitem__(self, index):
+        return self._cache[_check_index(index)]
+
+    def _get_resumable_iterator(self):
+        return iterators.SequenceIterator(self._cache)
+
 
 class _Repeated:
-    __slots__ = ['_generator', '_args', '_kwargs']
+    __slots__ = ['_generator', '_args', '_kwargs', '_resumable', '_cardinality',
+                 '_getitem']
 
-    def __init__(self, generator, *args, **kwargs):
+    def __init__(self, generator, *args, resumable=None, cardinality=None,
+                 getitem=None, **kwargs):
         self._generator = generator
         self._args = args
         self._kwargs = kwargs
+        self._resumable = resumable
+        self._cardinality = cardinality
+        self._getitem = getitem
 
     def __iter__(self):
         return self._generator(*self._args, **self._kwargs)
 
+    def get_resumable_iterator(self):
+        if self._resumable is None:
+            return iterators.IterableIterator(self)
+        return self._resumable(*self._args, **self._kwargs)
+
+    def cardinality(self):
+        if self._cardinality is None:
+            return UNKNOWN
+        return self._cardinality()
+
+    def __getitem__(self, index):
+        if self._getitem is None:
+            raise TypeError(
+                f'{self._generator!r} does not support random access')
+        return self._getitem(index, *self._args, **self._kwargs)
+
+
+# encodings in which the byte b'\n' only ever encodes a newline
+_BYTE_SPLIT_ENCODINGS = {'utf-8', 'utf-8-sig', 'ascii', 'iso8859-1',
+                         'cp1252'}
+
 
 class TextDataset(Dataset):
-    def __init__(self, filepath, encoding='utf-8'):
-        filepath = Path(filepath)
-        assert filepath.is_file()
+    def __init__(self, filepath, encoding='utf-8', random_access=False):
+        assert os.path.isfile(filepath)
 
         self._filepath = filepath
         self._encoding = encoding
+        self._random_access = random_access
+        self._offsets = None
+        self._byte_offsets = False
+
+    def _get_offsets(self):
+        # the positions of the lines, built on first use; byte offsets when
+        # splitting at b'\n' gives the lines of text mode, tell() cookies
+        # otherwise (e.g. UTF-16 or lone '\r' newlines)
+        if self._offsets is None:
+            offsets = self._get_byte_offsets()
+            self._byte_offsets = offsets is not None
+            if offsets is None:
+                offsets = self._get_text_offsets()
+            self._offsets = offsets
+        return self._offsets
+
+    def _get_byte_offsets(self):
+        name = codecs.lookup(self._encoding).name
+        if name not in _BYTE_SPLIT_ENCODINGS:
+            return None
+        offsets = array('q')
+        position = 0
+        with open(self._filepath, 'rb') as f:
+            for line in f:
+                i = line.find(b'\r')
+                if i >= 0 and not (i == len(line) - 2
+                                   and line.endswith(b'\n')):
+                    return None
+                offsets.append(position)
+                position += len(line)
+        return offsets
+
+    def _get_text_offsets(self):
+        # readline() rather than iteration keeps tell() usable
+        offsets = []
+        with open(self._filepath, encoding=self._encoding) as f:
+            while True:
+                position = f.tell()
+                if not f.readline():
+                    return offsets
+                offsets.append(position)
 
     @property
     def _dataset(self):
         def g(filepath, encoding):
-            with filepath.open(encoding=encoding) as f:
+            with open(filepath, encoding=encoding) as f:
                 for line in f:
                     yield line.rstrip()
-        return _Repeated(g, filepath=self._filepath, encoding=self._encoding)
+
+        if not self._random_access:
+            return _Repeated(g, filepath=self._filepath,
+                             encoding=self._encoding,
+                             resumable=iterators.TextIterator)
+
+        def h():
+            return len(self._get_offsets())
+
+        def i(index, filepath, encoding):
+            position = self._get_offsets()[index]
+            if self._byte_offsets:
+                with open(filepath, 'rb') as f:
+                    f.seek(position)
+                    return f.readline().decode(encoding).rstrip()
+            with open(filepath, encoding=encoding) as f:
+                f.seek(position)
+                return f.readline().rstrip()
+        return _Repeated(g, filepath=self._filepath, encoding=self._encoding,
+                         resumable=iterators.TextIterator, cardinality=h,
+                         getitem=i)
 
 
 class DirDataset(Dataset):
-    def __init__(self, dirpath, pattern='*'):
-        dirpath = Path(dirpath)
-        assert dirpath.is_dir()
+    def __init__(self, dirpath, pattern='*', index_path=None, n_threads=None):
+        assert os.path.isdir(dirpath)
 
-        self._dirpath = dirpath
+        self._dirpath = os.fspath(dirpath)
         self._pattern = pattern
+        self._index_path = index_path
+        self._n_threads = n_threads
+        self._index = None
+
+    def get_index(self):
+        from pipelib import listing
+
+        index = self._index
+        if index is not None and index.is_fresh():
+            return index
+
+        index_path = self._index_path
+        if index is None and index_path is not None \
+                and os.path.isfile(index_path):
+            try:
+                index = listing.DirectoryIndex.load(index_path)
+            except Exception:
+                # a corrupt or outdated index file is simply rebuilt
+                index = None
+            if index is not None and index.dirpath == self._dirpath \
+                    and index.pattern == self._pattern and index.is_fresh():
+                self._index = index
+                return index
+
+        index = listing.DirectoryIndex.build(
+            self._dirpath, self._pattern, self._n_threads)
+        if index_path is not None:
+            index.save(index_path)
+        self._index = index
+        return index
+
+    def shard(self, n_shards, index):
+        return Dataset(self.get_index().paths[index::n_shards])
 
     @property
     def _dataset(self):
-        def g(dirpath, pattern):
-            for path in dirpath.glob(pattern):
-                yield str(path)
-        return _Repeated(g, dirpath=self._dirpath, pattern=self._pattern)
+        if self._index_path is None:
+            def g(dirpath, pattern, n_threads):
+                from pipelib import listing
+
+                return listing.walk(dirpath, pattern, n_threads)
+            return _Repeated(g, dirpath=self._dirpath, pattern=self._pattern,
+                             n_threads=self._n_threads)
+
+        def g():
+            return iter(self.get_index().paths)
+
+        def h():
+            return iterators.SequenceIterator(self.get_index().paths)
+
+        def k():
+            return len(self.get_index())
+
+        def i(index):
+            # random access uses the index as of the last get_index() instead
+            # of checking its freshness on every lookup
+            index_ = self._index or self.get_index()
+            return index_.paths[index]
+        return _Repeated(g, resumable=h, cardinality=k, getitem=i)
@@ -0,0 +1,181 @@
+import math
+import pickle
+import struct
+import hashlib
+from array import array
+
+
+_LENGTH = struct.Struct('<Q')
+
+
+def _encode(x):
+    # a byte encoding under which values that compare equal in Python
+    # (1 == 1.0 == True, dicts with different insertion order, bytes and
+    # bytearray, set and frozenset) encode identically
+    if isinstance(x, str):
+        data = b's' + x.encode('utf-8', 'surrogatepass')
+    elif isinstance(x, (bytes, bytearray)):
+        data = b'b' + x
+    elif x is None:
+        return b'N'
+    elif isinstance(x, (int, float)):
+        if isinstance(x, float) and not x.is_integer():
+            data = b'f' + x.hex().encode()
+        else:
+            data = b'i' + str(int(x)).encode()
+    elif isinstance(x, (list, tuple)):
+        tag = b'l' if isinstance(x, list) else b't'
+        data = tag + b''.join(map(_encode, x))
+    elif isinstance(x, dict):
+        data = b'd' + b''.join(sorted(
+            _encode(k) + _encode(v) for k, v in x.items()))
+    elif isinstance(x, (set, frozenset)):
+        data = b'S' + b''.join(sorted(map(_encode, x)))
+    else:
+        # other objects are compared by their pickled form; key functions
+        # should map them to one of the types above for exact results
+        data = b'p' + pickle.dumps(x, 4)
+    return _LENGTH.pack(len(data)) + data
+
+
+def fingerprint(x):
+    return int.from_bytes(
+        hashlib.blake2b(_encode(x), digest_size=8).digest(), 'little')
+
+
+class FingerprintSet:
+    __slots__ = ['_table', '_mask', '_size']
+
+    def __init__(self, capacity=1024):
+        size = 8
+        while size < 2 * capacity:
+            size *= 2
+        self._table = array('Q', bytes(8 * size))
+        self._mask = size - 1
+        self._size = 0
+
+    def __len__(self):
+        return self._size
+
+    def __contains__(self, fp):
+        fp = fp or 1
+        table = self._table
+        mask = self._mask
+        i = fp & mask
+        while table[i]:
+            if table[i] == fp:
+                return True
+            i = (i + 1) & mask
+        return False
+
+    def add(self, fp):
+        # 0 marks an empty slot, so the (unlikely) zero fingerprint is remapped
+        fp = fp or 1
+        table = self._table
+        mask = self._mask
+        i = fp & mask
+        while table[i]:
+            if table[i] == fp:
+                return False
+            i = (i + 1) & mask
+        table[i] = fp
+        self._size += 1
+        if 2 * self._size > mask:
+            self._grow()
+        return True
+
+    def _grow(self):
+        old = self._table
+        self._table = array('Q', bytes(16 * len(old)))
+        self._mask = len(self._table) - 1
+        self._size = 0
+        for fp in old:
+            if fp:
+                self.add(fp)
+
+
+class BloomFilter:
+    __slots__ = ['_bits', '_n_bits', '_n_hashes', '_capacity', '_size']
+
+    def __init__(self, capacity, error_rate):
+        n_bits = math.ceil(-capacity * math.log(error_rate) / math.log(2) ** 2)
+        self._n_bits = max(n_bits, 8)
+        self._n_hashes = max(round(self._n_bits / capacity * math.log(2)), 1)
+        self._bits = bytearray((self._n_bits + 7) // 8)
+        self._capacity = capacity
+        self._size = 0
+
+    def __len__(self):
+        return self._size
+
+    @property
+    def full(self):
+        return self._size >= self._capacity
+
+    def _positions(self, fp):
+        h1 = fp & 0xffffffff
+        h2 = (fp >> 32) | 1
+        n_bits = self._n_bits
+        return [(h1 + i * h2) % n_bits for i in range(self._n_hashes)]
+
+    def __contains__(self, fp):
+        bits = self._bits
+        return all(bits[i >> 3] & (1 << (i & 7)) for i in self._positions(fp))
+
+    def add(self, fp):
+        bits = self._bits
+        added = False
+        for i in self._positions(fp):
+            mask = 1 << (i & 7)
+            if not bits[i >> 3] & mask:
+                bits[i >> 3] |= mask
+                added = True
+        if added:
+            self._size += 1
+        return added
+
+
+class ScalableBloomFilter:
+    __slots__ = ['_filters', '_capacity', '_error_rate']
+
+    def __init__(self, capacity=1024, error_rate=0.001):
+        # the error rates of the chained filters form a geometric series so
+        # that the overall false-positive rate stays below error_rate
+        self._capacity = capacity
+        self._error_rate = error_rate / 2
+        self._filters = [BloomFilter(capacity, self._error_rate)]
+
+    def __len__(self):
+        return sum(map(len, self._filters))
+
+    def __contains__(self, fp):
+        return any(fp in f for f in self._filters)
+
+    def add(self, fp):
+        if fp in self:
+            return False
+        if self._filters[-1].full:
+            self._capacity *= 2
+            self._error_rate /= 2
+            self._filters.append(BloomFilter(self._capacity, self._error_rate))
+        return self._filters[-1].add(fp)
+
+
+def get_seen_set(exact=True, error_rate=0.001, capacity=1024):
+    if exact:
+        return FingerprintSet(capacity)
+    return ScalableBloomFilter(capacity, error_rate)
+
+
+def distinct(iterable, key=None, seen=None):
+    if seen is None:
+        seen = FingerprintSet()
+    add = seen.add
+    if key is None:
+        for x in iterable:
+            if add(fingerprint(x)):
+                yield x
+    else:
+        for x in iterable:
+            if add(fingerprint(key(x))):
+                yield x
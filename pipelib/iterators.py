@@ -1,24 +1,55 @@
+import random
+from abc import ABC, abstractmethod
 import threading
 import queue
+from itertools import islice
+from collections import deque
+from collections.abc import Sequence
+
+from pipelib.autotune import AUTOTUNE, BufferTuner
+
+
+class _Failure:
+    __slots__ = ['exception']
+
+    def __init__(self, exception):
+        self.exception = exception
 
 
 class PrefetchIterator:
-    def __init__(self, dataset, n_prefetch=1):
+    def __init__(self, dataset, n_prefetch=1, memory_limit=None):
         self._dataset = dataset
-        self._queue = queue.Queue(maxsize=n_prefetch)
+        if n_prefetch == AUTOTUNE:
+            self._tuner = BufferTuner(memory_limit)
+            n_prefetch = self._tuner.size
+        else:
+            self._tuner = None
+        self._n_prefetch = n_prefetch
         self._thread = self._launch_thread()
 
     def _launch_thread(self):
+        # every run gets its own buffer, so that a closed producer that is
+        # still finishing its last element cannot leak it into the next run
+        if self._tuner is not None:
+            self._n_prefetch = self._tuner.size
+        self._queue = queue.Queue(maxsize=self._n_prefetch)
+        self._stop = threading.Event()
         thread = threading.Thread(target=self._task,
-                                  args=(self._dataset, self._queue))
+                                  args=(self._dataset, self._queue, self._stop))
         thread.daemon = True
         thread.start()
         return thread
 
     @staticmethod
-    def _task(dataset, queue):
-        for x in dataset:
-            queue.put(x)
+    def _task(dataset, queue, stop):
+        try:
+            for x in dataset:
+                queue.put(x)
+                if stop.is_set():
+                    return
+        except Exception as e:
+            queue.put(_Failure(e))
+            return
         queue.put(StopIteration)
 
     def __iter__(self):
@@ -28,10 +59,371 @@ class PrefetchIterator:
         if self._thread is None:
             self._thread = self._launch_thread()
 
-        x = self._queue.get()
+        q = self._queue
+        tuner = self._tuner
+        if tuner is None:
+            x = q.get()
+        else:
+            waited = q.empty()
+            x = q.get()
+            tuner.record(waited, x)
+            if tuner.size != q.maxsize:
+                with q.mutex:
+                    q.maxsize = tuner.size
+                    q.not_full.notify()
 
         if x is StopIteration:
             self._thread = None
             raise x
+        elif isinstance(x, _Failure):
+            self._thread = None
+            raise x.exception
         else:
             return x
+
+    def close(self):
+        # a producer blocked on a full buffer is freed by draining it, and
+        # stops after its current element without waiting to be joined
+        if self._thread is None:
+            return
+        self._stop.set()
+        while True:
+            try:
+                self._queue.get_nowait()
+            except queue.Empty:
+                break
+        self._thread = None
+
+
+class ResumableIterator(ABC):
+    def __iter__(self):
+        return self
+
+    @abstractmethod
+    def __next__(self):
+        pass
+
+    @abstractmethod
+    def get_state(self):
+        pass
+
+    @abstractmethod
+    def set_state(self, state):
+        pass
+
+    @abstractmethod
+    def reset(self):
+        pass
+
+
+def get_state(iterator):
+    if not isinstance(iterator, ResumableIterator):
+        raise TypeError(
+            f'{type(iterator).__name__} does not support resumable iteration')
+    return iterator.get_state()
+
+
+def get_resumable_iterator(iterable):
+    if hasattr(iterable, 'get_resumable_iterator'):
+        return iterable.get_resumable_iterator()
+    if isinstance(iterable, Sequence):
+        return SequenceIterator(iterable)
+    iterator = iter(iterable)
+    if isinstance(iterator, ResumableIterator):
+        return iterator
+    if iterator is iterable:
+        raise TypeError('one-shot iterators do not support resumable iteration')
+    return IterableIterator(iterable)
+
+
+class SequenceIterator(ResumableIterator):
+    def __init__(self, sequence):
+        self._sequence = sequence
+        self._index = 0
+
+    def __next__(self):
+        index = self._index
+        if index >= len(self._sequence):
+            raise StopIteration
+        self._index = index + 1
+        return self._sequence[index]
+
+    def get_state(self):
+        return self._index
+
+    def set_state(self, state):
+        self._index = state
+
+    def reset(self):
+        self._index = 0
+
+
+class IterableIterator(ResumableIterator):
+    def __init__(self, iterable):
+        self._iterable = iterable
+        self._iterator = iter(iterable)
+        self._count = 0
+
+    def __next__(self):
+        x = next(self._iterator)
+        self._count += 1
+        return x
+
+    def get_state(self):
+        return self._count
+
+    def set_state(self, state):
+        # the source has no random access, so its elements are skipped
+        # without running any of the downstream operations
+        self._iterator = islice(iter(self._iterable), state, None)
+        self._count = state
+
+    def reset(self):
+        self.set_state(0)
+
+
+class TextIterator(ResumableIterator):
+    def __init__(self, filepath, encoding='utf-8'):
+        self._filepath = filepath
+        self._encoding = encoding
+        self._file = None
+        # an opaque text-mode tell() cookie, or None once exhausted
+        self._position = 0
+
+    def __next__(self):
+        if self._file is None:
+            if self._position is None:
+                raise StopIteration
+            self._file = open(self._filepath, encoding=self._encoding)
+            self._file.seek(self._position)
+
+        # readline() rather than next() keeps tell() usable
+        line = self._file.readline()
+        if not line:
+            self._file.close()
+            self._file = None
+            self._position = None
+            raise StopIteration
+        return line.rstrip()
+
+    def get_state(self):
+        if self._file is not None:
+            # tell() is costly in text mode, so it is only called here
+            return self._file.tell()
+        return self._position
+
+    def set_state(self, state):
+        if self._file is not None:
+            self._file.close()
+            self._file = None
+        self._position = state
+
+    def reset(self):
+        self.set_state(0)
+
+    def __del__(self):
+        if self._file is not None:
+            self._file.close()
+
+
+class RepeatIterator(ResumableIterator):
+    def __init__(self, iterator):
+        self._iterator = iterator
+        self._epoch = 0
+
+    def __next__(self):
+        try:
+            return next(self._iterator)
+        except StopIteration:
+            self._iterator.reset()
+            self._epoch += 1
+        # a second StopIteration in a row means the source is empty
+        return next(self._iterator)
+
+    def get_state(self):
+        return self._epoch, get_state(self._iterator)
+
+    def set_state(self, state):
+        self._epoch, state = state
+        self._iterator.set_state(state)
+
+    def reset(self):
+        self._iterator.reset()
+        self._epoch = 0
+
+
+class BatchIterator(ResumableIterator):
+    def __init__(self, iterator, batch_size):
+        self._iterator = iterator
+        self._batch_size = batch_size
+
+    def __next__(self):
+        batch = list(islice(self._iterator, self._batch_size))
+        if not batch:
+            raise StopIteration
+        return batch
+
+    def get_state(self):
+        return get_state(self._iterator)
+
+    def set_state(self, state):
+        self._iterator.set_state(state)
+
+    def reset(self):
+        self._iterator.reset()
+
+
+class ShuffleIterator(ResumableIterator):
+    def __init__(self, iterator, shuffle_size):
+        self._iterator = iterator
+        self._shuffle_size = shuffle_size
+        self._random = random.Random(random.getrandbits(64))
+        self._buffer = []
+
+    def __next__(self):
+        if not self._buffer:
+            self._buffer = list(islice(self._iterator, self._shuffle_size))
+            if not self._buffer:
+                raise StopIteration
+            self._random.shuffle(self._buffer)
+        return self._buffer.pop()
+
+    def get_state(self):
+        return (self._random.getstate(), list(self._buffer),
+                get_state(self._iterator))
+
+    def set_state(self, state):
+        random_state, buffer, state = state
+        self._random.setstate(random_state)
+        self._buffer = list(buffer)
+        self._iterator.set_state(state)
+
+    def reset(self):
+        self._iterator.reset()
+        self._buffer = []
+
+
+class WindowIterator(ResumableIterator):
+    def __init__(self, iterator, window_size):
+        self._iterator = iterator
+        self._window = deque(maxlen=window_size)
+
+    def __next__(self):
+        window = self._window
+        if not window:
+            window.extend(islice(self._iterator, window.maxlen))
+            if len(window) < window.maxlen:
+                window.clear()
+                raise StopIteration
+        else:
+            window.append(next(self._iterator))
+        return tuple(window)
+
+    def get_state(self):
+        return list(self._window), get_state(self._iterator)
+
+    def set_state(self, state):
+        window, state = state
+        self._window.clear()
+        self._window.extend(window)
+        self._iterator.set_state(state)
+
+    def reset(self):
+        self._iterator.reset()
+        self._window.clear()
+
+
+class MapIterator(ResumableIterator):
+    def __init__(self, iterator, map_func):
+        self._iterator = iterator
+        self._map_func = map_func
+
+    def __next__(self):
+        return self._map_func(next(self._iterator))
+
+    def get_state(self):
+        return get_state(self._iterator)
+
+    def set_state(self, state):
+        self._iterator.set_state(state)
+
+    def reset(self):
+        self._iterator.reset()
+
+
+class FlatMapIterator(MapIterator):
+    def __init__(self, iterator, map_func):
+        super().__init__(iterator, map_func)
+        self._current = iter(())
+
+    def __next__(self):
+        while True:
+            for x in self._current:
+                return x
+            self._current = iter(self._map_func(next(self._iterator)))
+
+    def get_state(self):
+        pending = list(self._current)
+        self._current = iter(pending)
+        return pending, get_state(self._iterator)
+
+    def set_state(self, state):
+        pending, state = state
+        self._current = iter(list(pending))
+        self._iterator.set_state(state)
+
+    def reset(self):
+        self._iterator.reset()
+        self._current = iter(())
+
+
+class FilterIterator(MapIterator):
+    def __next__(self):
+        while True:
+            x = next(self._iterator)
+            if self._map_func(x):
+                return x
+
+
+class ZipIterator(ResumableIterator):
+    def __init__(self, *iterators):
+        self._iterators = iterators
+
+    def __next__(self):
+        return tuple([next(it) for it in self._iterators])
+
+    def get_state(self):
+        return tuple(get_state(it) for it in self._iterators)
+
+    def set_state(self, state):
+        for it, s in zip(self._iterators, state):
+            it.set_state(s)
+
+    def reset(self):
+        for it in self._iterators:
+            it.reset()
+
+
+class ChainIterator(ZipIterator):
+    def __init__(self, *iterators):
+        super().__init__(*iterators)
+        self._index = 0
+
+    def __next__(self):
+        while self._index < len(self._iterators):
+            try:
+                return next(self._iterators[self._index])
+            except StopIteration:
+                self._index += 1
+        raise StopIteration
+
+    def get_state(self):
+        return self._index, super().get_state()
+
+    def set_state(self, state):
+        self._index, state = state
+        super().set_state(state)
+
+    def reset(self):
+        super().reset()
+        self._index = 0
@@ -0,0 +1,169 @@
+import os
+import re
+import pickle
+import fnmatch
+from array import array
+
+
+def compile_pattern(pattern):
+    parts = [part for part in re.split(r'[\\/]', pattern) if part]
+    matchers = []
+    for part in parts:
+        if part == '**':
+            if not matchers or matchers[-1] is not None:
+                matchers.append(None)
+        else:
+            matchers.append(re.compile(fnmatch.translate(part)).match)
+    if not matchers:
+        raise ValueError(f'Unacceptable pattern: {pattern!r}')
+    return matchers
+
+
+def _scan_dir(path, matchers, dirs=None, stat=False):
+    # None stands for '**', which matches this directory and any below it
+    recursive = matchers[0] is None
+    patterns = matchers[1:] if recursive else matchers
+    matches = []
+    jobs = []
+
+    # like Path.glob, unreadable or vanished entries are skipped
+    try:
+        if dirs is not None:
+            dirs[path] = os.stat(path).st_mtime_ns
+        if recursive and not patterns:
+            matches.append(_describe(path, None, stat))
+        with os.scandir(path) as it:
+            entries = list(it)
+    except OSError:
+        return [], []
+
+    for entry in entries:
+        try:
+            is_dir = entry.is_dir()
+        except OSError:
+            is_dir = False
+        if patterns and patterns[0](entry.name):
+            if len(patterns) == 1:
+                try:
+                    matches.append(_describe(entry.path, entry, stat))
+                except OSError:
+                    pass
+            elif is_dir:
+                jobs.append((entry.path, patterns[1:]))
+        if recursive and is_dir and not entry.is_symlink():
+            jobs.append((entry.path, matchers))
+    return matches, jobs
+
+
+def _describe(path, entry, stat):
+    if not stat:
+        return path
+    st = os.stat(path) if entry is None else entry.stat()
+    return path, st.st_size, st.st_mtime_ns
+
+
+def walk(dirpath, pattern='*', n_threads=None, dirs=None, stat=False):
+    jobs = [(os.fspath(dirpath), compile_pattern(pattern))]
+
+    if not n_threads:
+        while jobs:
+            path, matchers = jobs.pop()
+            matches, subjobs = _scan_dir(path, matchers, dirs, stat)
+            yield from matches
+            jobs.extend(reversed(subjobs))
+        return
+
+    from concurrent.futures import ThreadPoolExecutor, wait, FIRST_COMPLETED
+
+    # directory listings release the GIL, which hides the per-directory
+    # latency of network filesystems
+    with ThreadPoolExecutor(n_threads) as executor:
+        pending = {executor.submit(_scan_dir, path, matchers, dirs, stat)
+                   for path, matchers in jobs}
+        while pending:
+            done, pending = wait(pending, return_when=FIRST_COMPLETED)
+            for future in done:
+                matches, subjobs = future.result()
+                yield from matches
+                pending.update(
+                    executor.submit(_scan_dir, path, matchers, dirs, stat)
+                    for path, matchers in subjobs)
+
+
+def _list_other_entries(path, name):
+    return sorted(n for n in os.listdir(path)
+                  if n != name and not n.startswith(f'.{name}.tmp'))
+
+
+class DirectoryIndex:
+    __slots__ = ['dirpath', 'pattern', 'paths', 'sizes', 'mtimes', 'dirs',
+                 'index_dir']
+
+    def __init__(self, dirpath, pattern, paths, sizes, mtimes, dirs,
+                 index_dir=None):
+        self.dirpath = dirpath
+        self.pattern = pattern
+        self.paths = paths
+        self.sizes = sizes
+        self.mtimes = mtimes
+        self.dirs = dirs
+        # (directory, index file name, other entries) when the index is
+        # saved inside an indexed directory, whose mtime it then changes
+        self.index_dir = index_dir
+
+    def __len__(self):
+        return len(self.paths)
+
+    @classmethod
+    def build(cls, dirpath, pattern='*', n_threads=None):
+        dirpath = os.fspath(dirpath)
+        dirs = {}
+        entries = sorted(walk(dirpath, pattern, n_threads, dirs, stat=True))
+        paths = [path for path, _, _ in entries]
+        sizes = array('q', (size for _, size, _ in entries))
+        mtimes = array('q', (mtime for _, _, mtime in entries))
+        return cls(dirpath, pattern, paths, sizes, mtimes, dirs)
+
+    def is_fresh(self):
+        # adding, removing or renaming an entry updates the mtime of its
+        # parent directory, so only the directories have to be checked
+        try:
+            for path, mtime in self.dirs.items():
+                if os.stat(path).st_mtime_ns == mtime:
+                    continue
+                if self.index_dir is None or self.index_dir[0] != path:
+                    return False
+                _, name, entries = self.index_dir
+                if _list_other_entries(path, name) != entries:
+                    return False
+            return True
+        except OSError:
+            return False
+
+    def save(self, filename):
+        filename = os.fspath(filename)
+        parent, name = os.path.split(os.path.abspath(filename))
+        self.index_dir = None
+        for path in self.dirs:
+            if os.path.abspath(path) == parent:
+                self.index_dir = (path, name,
+                                  _list_other_entries(path, name))
+                break
+
+        # written aside and moved into place, so that concurrent readers
+        # never see a partial index
+        tmp_path = os.path.join(parent, f'.{name}.tmp{os.getpid()}')
+        state = {slot: getattr(self, slot) for slot in self.__slots__}
+        try:
+            with open(tmp_path, 'wb') as f:
+                pickle.dump(state, f, pickle.HIGHEST_PROTOCOL)
+            os.replace(tmp_path, filename)
+        except BaseException:
+            if os.path.exists(tmp_path):
+                os.remove(tmp_path)
+            raise
+
+    @classmethod
+    def load(cls, filename):
+        with open(filename, 'rb') as f:
+            return cls(**pickle.load(f))
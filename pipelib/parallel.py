@@ -1,6 +1,193 @@
-from itertools import chain
+import os
+import sys
+import queue
+import pickle
+import random
+import signal
+import threading
+import time
+import traceback
+from itertools import chain, islice
+from collections import deque
 
 import multiprocess
+from multiprocess.reduction import ForkingPickler
+from multiprocess.util import Finalize
+
+from pipelib.autotune import AUTOTUNE, ParallelismTuner
+
+
+_worker_func = None
+
+
+def _init_worker(func):
+    global _worker_func
+    _worker_func = func
+
+
+def _call_worker_func(x):
+    return _worker_func(x)
+
+
+def _map_worker_func(chunk):
+    return [_worker_func(x) for x in chunk]
+
+
+def _dumps(obj):
+    # dill is an order of magnitude slower than pickle, so it is only used
+    # for what pickle cannot handle (lambdas, local classes); pickle.loads
+    # reads both
+    try:
+        return pickle.dumps(obj, pickle.HIGHEST_PROTOCOL)
+    except Exception:
+        return ForkingPickler.dumps(obj)
+
+
+def _run_worker(func, tasks, read_lock, results, write_lock):
+    _init_worker(func)
+    # SIGTERM is held back while a result is written, so that terminating
+    # the pool never leaves a partial message or a held lock behind
+    block = getattr(signal, 'pthread_sigmask', None)
+    while True:
+        with read_lock:
+            i, task, args = pickle.loads(tasks.recv_bytes())
+        try:
+            message = _dumps((i, True, task(*args)))
+        except Exception as e:
+            message = _dumps((i, False, _RemoteError(e).exception))
+        if block is not None:
+            block(signal.SIG_BLOCK, {signal.SIGTERM})
+        with write_lock:
+            results.send_bytes(message)
+        if block is not None:
+            block(signal.SIG_UNBLOCK, {signal.SIGTERM})
+
+
+class _AsyncResult:
+    __slots__ = ['_event', '_value', '_success', '_callback',
+                 '_error_callback']
+
+    def __init__(self, callback=None, error_callback=None):
+        self._event = threading.Event()
+        self._value = None
+        self._success = None
+        self._callback = callback
+        self._error_callback = error_callback
+
+    def ready(self):
+        return self._event.is_set()
+
+    def get(self):
+        self._event.wait()
+        if not self._success:
+            raise self._value
+        return self._value
+
+    def _set(self, success, value):
+        self._success = success
+        self._value = value
+        self._event.set()
+        if success and self._callback is not None:
+            self._callback(value)
+        elif not success and self._error_callback is not None:
+            self._error_callback(value)
+
+
+class _WorkerPool:
+    # Like multiprocess.Pool, but workers are started as tasks are submitted,
+    # so a pool that only ever sees a few tasks stays small. Leaving the
+    # context terminates the workers and drops outstanding tasks at once.
+    def __init__(self, n, func):
+        self._n = n
+        self._func = func
+        self._tasks, self._task_writer = multiprocess.Pipe(duplex=False)
+        self._results, self._result_writer = multiprocess.Pipe(duplex=False)
+        self._read_lock = multiprocess.Lock()
+        self._write_lock = multiprocess.Lock()
+        self._workers = []
+        self._pending = {}
+        self._next_id = 0
+        self._lock = threading.Lock()
+        self._collector = threading.Thread(target=self._collect, daemon=True)
+        self._collector.start()
+
+    def _collect(self):
+        while True:
+            if not self._results.poll(0.1):
+                self._check_workers()
+                continue
+            message = self._results.recv_bytes()
+            if not message:
+                return
+            i, success, value = pickle.loads(message)
+            with self._lock:
+                result = self._pending.pop(i, None)
+            if result is not None:
+                result._set(success, value)
+
+    def _check_workers(self):
+        # a worker that died (e.g. killed by the OOM killer) takes its task
+        # with it, so the outstanding results are failed instead of awaited
+        if all(worker.is_alive() for worker in list(self._workers)):
+            return
+        with self._lock:
+            pending = list(self._pending.values())
+            self._pending.clear()
+        for result in pending:
+            result._set(False, RuntimeError('a worker exited unexpectedly'))
+
+    def _start_worker(self):
+        worker = multiprocess.Process(
+            target=_run_worker,
+            args=(self._func, self._tasks, self._read_lock,
+                  self._result_writer, self._write_lock),
+            daemon=True)
+        worker.start()
+        self._workers.append(worker)
+
+    def apply_async(self, task, args=(), callback=None, error_callback=None):
+        result = _AsyncResult(callback, error_callback)
+        with self._lock:
+            i = self._next_id
+            self._next_id += 1
+            self._pending[i] = result
+            n_pending = len(self._pending)
+        if len(self._workers) < min(n_pending, self._n):
+            self._start_worker()
+        self._task_writer.send_bytes(_dumps((i, task, args)))
+        return result
+
+    def terminate(self):
+        for worker in self._workers:
+            worker.terminate()
+        for worker in self._workers:
+            worker.join()
+        self._workers = []
+        # the workers are gone, so the parent is the only writer left
+        self._result_writer.send_bytes(b'')
+        self._collector.join()
+        for connection in (self._tasks, self._task_writer, self._results,
+                           self._result_writer):
+            connection.close()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc_info):
+        self.terminate()
+
+
+def _get_pool(n, func):
+    # the function is installed in each worker once at start-up (inherited
+    # without serialization under fork) instead of being sent with every
+    # task; tasks only carry a reference to _call_worker_func
+    if n is None or n == AUTOTUNE:
+        n = os.cpu_count() or 1
+    return _WorkerPool(n, func)
+
+
+def _get_tuner(n):
+    return ParallelismTuner() if n == AUTOTUNE else None
 
 
 class MapParallel:
@@ -8,26 +195,47 @@ class MapParallel:
         self._func = func
         self._n = n
         self._chunksize = chunksize
-        if not unordered:
-            self._map_method = 'imap'
+        self._unordered = unordered
+
+    def _imap(self, func, dataset):
+        tuner = _get_tuner(self._n)
+        if tuner is None:
+            max_pending = 2 * (self._n or os.cpu_count() or 1)
         else:
-            self._map_method = 'imap_unordered'
+            max_pending = tuner.max_pending
+        imap = _imap_unordered_bounded if self._unordered else _imap_bounded
+        chunks = _chunked(dataset, self._chunksize)
+
+        with _get_pool(self._n, func) as p:
+            try:
+                for _, results in imap(p, _map_worker_func, chunks,
+                                       max_pending, tuner):
+                    yield from results
+            finally:
+                if tuner is not None:
+                    tuner.close()
 
     def __call__(self, dataset):
-        with multiprocess.Pool(self._n) as p:
-            yield from getattr(p, self._map_method)(
-                self._func, dataset, self._chunksize)
+        return self._imap(self._func, dataset)
+
+    def cardinality(self, n):
+        return n
+
+    def elementwise(self, x):
+        return self._func(x)
 
 
 class FlatMapParallel(MapParallel):
+    cardinality = None
+    elementwise = None
+
     def __call__(self, dataset):
-        with multiprocess.Pool(self._n) as p:
-            yield from chain.from_iterable(
-                getattr(p, self._map_method)(
-                    self._func, dataset, self._chunksize))
+        return chain.from_iterable(self._imap(self._func, dataset))
 
 
 class FilterParallel(MapParallel):
+    cardinality = None
+    elementwise = None
 
     class _FilterTask:
         __slots__ = ['_predicate']
@@ -40,8 +248,271 @@ class FilterParallel(MapParallel):
 
     def __call__(self, dataset):
         task = self._FilterTask(self._func)
+        return (x for x, keep in self._imap(task, dataset) if keep)
+
+
+def _ramp_up(limit, max_pending, tuner):
+    if tuner is not None:
+        return tuner.max_pending
+    return min(2 * limit, max_pending)
+
+
+def _imap_bounded(pool, task, chunks, max_pending, tuner=None):
+    # keep a bounded number of chunks in flight so that neither the input
+    # nor the results pile up in the parent; the bound starts at one chunk
+    # and doubles with every result consumed, so a consumer that stops
+    # early leaves little work behind
+    pending = deque()
+    limit = 1 if tuner is None else max_pending
+    for chunk in chunks:
+        pending.append((chunk, pool.apply_async(task, (chunk,))))
+        while len(pending) >= limit:
+            chunk, result = pending.popleft()
+            if tuner is not None:
+                tuner.record(not result.ready(),
+                             sum(r.ready() for _, r in pending))
+            yield chunk, result.get()
+            limit = _ramp_up(limit, max_pending, tuner)
+    while pending:
+        chunk, result = pending.popleft()
+        yield chunk, result.get()
+
+
+_FAILED = object()
+
+
+def _imap_unordered_bounded(pool, task, chunks, max_pending, tuner=None):
+    done = queue.Queue()
+
+    def submit(chunk):
+        pool.apply_async(task, (chunk,),
+                         callback=lambda result: done.put((chunk, result)),
+                         error_callback=lambda e: done.put((_FAILED, e)))
+
+    def get():
+        if tuner is not None:
+            tuner.record(done.empty(), done.qsize())
+        chunk, result = done.get()
+        if chunk is _FAILED:
+            raise result
+        return chunk, result
+
+    n_pending = 0
+    limit = 1 if tuner is None else max_pending
+    for chunk in chunks:
+        submit(chunk)
+        n_pending += 1
+        while n_pending >= limit:
+            n_pending -= 1
+            yield get()
+            limit = _ramp_up(limit, max_pending, tuner)
+    while n_pending:
+        n_pending -= 1
+        yield get()
+
+
+def _chunked(dataset, chunksize):
+    iterator = iter(dataset)
+    return iter(lambda: list(islice(iterator, chunksize)), [])
+
+
+class AggregateParallel:
+
+    class _AggregateTask:
+        __slots__ = ['_combiner']
+
+        def __init__(self, combiner):
+            self._combiner = combiner
+
+        def __call__(self, chunk):
+            return self._combiner.add_all(self._combiner.create(), chunk)
+
+    def __init__(self, combiner, n=None, chunksize=1024):
+        self._combiner = combiner
+        self._n = n
+        self._chunksize = chunksize
+
+    def __call__(self, dataset):
+        combiner = self._combiner
+        task = self._AggregateTask(combiner)
+        chunks = _chunked(dataset, self._chunksize)
+        tuner = _get_tuner(self._n)
+        if tuner is None:
+            max_pending = 2 * (self._n or os.cpu_count() or 1)
+        else:
+            max_pending = tuner.max_pending
+
+        accumulator = combiner.create()
+        with _get_pool(self._n, task) as p:
+            try:
+                for _, partial in _imap_bounded(
+                        p, _call_worker_func, chunks, max_pending, tuner):
+                    accumulator = combiner.merge(accumulator, partial)
+            finally:
+                if tuner is not None:
+                    tuner.close()
+        return combiner.result(accumulator)
+
+
+class BatchLoader:
+
+    class _BatchTask:
+        __slots__ = ['_dataset', '_collate']
+
+        def __init__(self, dataset, collate):
+            self._dataset = dataset
+            self._collate = collate
+
+        def __call__(self, indices):
+            dataset = self._dataset
+            batch = [dataset[i] for i in indices]
+            return batch if self._collate is None else self._collate(batch)
+
+    def __init__(self, dataset, batch_size, n=None, n_prefetch=2,
+                 collate=None, shuffle=False, drop_last=False):
+        self._dataset = dataset
+        self._batch_size = batch_size
+        self._n = n
+        self._n_prefetch = n_prefetch
+        self._collate = collate
+        self._shuffle = shuffle
+        self._drop_last = drop_last
+
+    def cardinality(self):
+        n = self._dataset.cardinality()
+        if n < 0:
+            return n
+        if self._drop_last:
+            return n // self._batch_size
+        return -(-n // self._batch_size)
+
+    def __iter__(self):
+        n = self._dataset.cardinality()
+        if n < 0:
+            raise TypeError('batch_parallel requires a dataset of known length')
+        indices = range(n)
+        if self._shuffle:
+            indices = list(indices)
+            random.shuffle(indices)
+        batch_size = self._batch_size
+        batches = _chunked(indices, batch_size)
+        if self._drop_last:
+            batches = (batch for batch in batches if len(batch) == batch_size)
+
+        # workers fetch and collate whole batches from their own copy of the
+        # dataset, so only indices and finished batches cross processes
+        tuner = _get_tuner(self._n)
+        if tuner is None:
+            max_pending = (self._n or os.cpu_count() or 1) * self._n_prefetch
+        else:
+            max_pending = tuner.max_pending
+        task = self._BatchTask(self._dataset, self._collate)
+        with _get_pool(self._n, task) as p:
+            try:
+                for _, batch in _imap_bounded(p, _call_worker_func, batches,
+                                              max_pending, tuner):
+                    yield batch
+            finally:
+                if tuner is not None:
+                    tuner.close()
+
+
+class _RemoteError:
+    __slots__ = ['exception']
+
+    def __init__(self, exception):
+        try:
+            ForkingPickler.dumps(exception)
+        except Exception:
+            exception = RuntimeError(''.join(traceback.format_exception(
+                type(exception), exception, exception.__traceback__)))
+        self.exception = exception
+
+
+def _run_stage(dataset, q, chunksize):
+    # terminate() raises SystemExit here, so that the upstream generators
+    # are closed and shut down the stages they run themselves
+    def exit(signum, frame):
+        # the consumer stopped reading, so chunks still buffered for the
+        # queue must not keep this process from exiting
+        q.cancel_join_thread()
+        sys.exit(1)
+
+    signal.signal(signal.SIGTERM, exit)
+    iterator = iter(dataset)
+    try:
+        for chunk in iter(lambda: list(islice(iterator, chunksize)), []):
+            q.put(chunk)
+    except Exception as e:
+        q.put(_RemoteError(e))
+        return
+    finally:
+        close = getattr(iterator, 'close', None)
+        if close is not None:
+            close()
+    q.put(None)
+
+
+def _stop_stage(process, q, timeout=5):
+    if process.is_alive():
+        process.terminate()
+        # the stage may be blocked writing a large chunk; nothing more is
+        # read from the queue, so its pipe is emptied as raw bytes, which
+        # cannot block on a message cut off by the exit
+        fd = q._reader.fileno()
+        os.set_blocking(fd, False)
+        deadline = time.monotonic() + timeout
+        while process.exitcode is None and time.monotonic() < deadline:
+            try:
+                while os.read(fd, 1 << 16):
+                    pass
+            except BlockingIOError:
+                pass
+            process.join(0.01)
+        if process.exitcode is None:
+            process.kill()
+        process.join()
+    q.close()
+
+
+class Stage:
+    def __init__(self, dataset, n_prefetch=1, chunksize=1):
+        self._dataset = dataset
+        self._n_prefetch = n_prefetch
+        self._chunksize = chunksize
+
+    def cardinality(self):
+        return self._dataset.cardinality()
+
+    def __getitem__(self, index):
+        return self._dataset[index]
 
-        with multiprocess.Pool(self._n) as p:
-            yield from (x for x, keep in
-                        getattr(p, self._map_method)(
-                            task, dataset, self._chunksize) if keep)
+    def __iter__(self):
+        # the upstream pipeline runs in its own process and streams into a
+        # bounded queue; an upstream stage is started by that process and
+        # feeds it directly
+        q = multiprocess.Queue(self._n_prefetch)
+        process = multiprocess.Process(
+            target=_run_stage, args=(self._dataset, q, self._chunksize))
+        process.start()
+        # a stage left running by an unfinished iterator would otherwise
+        # keep the interpreter from exiting
+        stop = Finalize(
+            None, _stop_stage, args=(process, q), exitpriority=10)
+        try:
+            while True:
+                try:
+                    chunk = q.get(timeout=0.1)
+                except queue.Empty:
+                    if process.is_alive() or not q.empty():
+                        continue
+                    raise RuntimeError(
+                        f'stage process exited with code {process.exitcode}')
+                if chunk is None:
+                    break
+                if isinstance(chunk, _RemoteError):
+                    raise chunk.exception
+                yield from chunk
+            process.join()
+        finally:
+            stop()
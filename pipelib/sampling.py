@@ -0,0 +1,109 @@
+import random
+from itertools import repeat
+
+from pipelib import iterators
+
+
+DRAW_SIZE = 1024
+
+
+class FenwickTree:
+    # prefix sums of the source weights, so that drawing a source and
+    # removing an exhausted one both take O(log n)
+    __slots__ = ['_tree', '_weights', '_top']
+
+    def __init__(self, weights):
+        n = len(weights)
+        tree = [0.0] * (n + 1)
+        for i, w in enumerate(weights, 1):
+            tree[i] += w
+            j = i + (i & -i)
+            if j <= n:
+                tree[j] += tree[i]
+        self._tree = tree
+        self._weights = list(weights)
+        self._top = 1 << (n.bit_length() - 1) if n else 0
+
+    def __getitem__(self, i):
+        return self._weights[i]
+
+    def add(self, i, delta):
+        self._weights[i] += delta
+        tree = self._tree
+        i += 1
+        while i < len(tree):
+            tree[i] += delta
+            i += i & -i
+
+    def total(self):
+        tree = self._tree
+        total = 0.0
+        i = len(tree) - 1
+        while i:
+            total += tree[i]
+            i -= i & -i
+        return total
+
+    def find(self, u):
+        # the index i with prefix(i) <= u < prefix(i + 1)
+        tree = self._tree
+        i = 0
+        step = self._top
+        while step:
+            j = i + step
+            if j < len(tree) and tree[j] <= u:
+                i = j
+                u -= tree[j]
+            step >>= 1
+        return i
+
+
+def _check_weights(weights, n):
+    if weights is None:
+        return [1.0] * n
+    weights = [float(w) for w in weights]
+    if len(weights) != n:
+        raise ValueError('weights must have one entry per dataset')
+    if any(w < 0 for w in weights) or not sum(weights) > 0:
+        raise ValueError('weights must be non-negative with a positive sum')
+    return weights
+
+
+def sample_from(datasets, weights=None, seed=None, n_prefetch=0):
+    weights = _check_weights(weights, len(datasets))
+    rng = random.Random(random.getrandbits(64) if seed is None else seed)
+
+    # sources with zero weight are never drawn and never opened
+    if n_prefetch:
+        sources = [iterators.PrefetchIterator(d, n_prefetch) if w else None
+                   for d, w in zip(datasets, weights)]
+    else:
+        sources = [iter(d) if w else None for d, w in zip(datasets, weights)]
+    tree = FenwickTree(weights)
+    n_alive = sum(1 for w in weights if w)
+    total = tree.total()
+
+    try:
+        while n_alive:
+            # uniforms are drawn in blocks and scaled by the current total,
+            # which stays valid when sources are removed in between
+            for u in [rng.random() for _ in repeat(None, DRAW_SIZE)]:
+                i = tree.find(u * total)
+                if i >= len(sources) or not tree[i]:
+                    # rounding left over from removed sources
+                    continue
+                for x in sources[i]:
+                    yield x
+                    break
+                else:
+                    tree.add(i, -tree[i])
+                    sources[i] = None
+                    n_alive -= 1
+                    if not n_alive:
+                        return
+                    # recomputed rather than updated to avoid drift
+                    total = tree.total()
+    finally:
+        for source in sources:
+            if isinstance(source, iterators.PrefetchIterator):
+                source.close()
@@ -1,20 +1,131 @@
+import os
+import mmap
+import pickle
+import struct
 from pathlib import Path
-import cloudpickle
 
 import pipelib
 
 
+PROTOCOL = max(pickle.DEFAULT_PROTOCOL, min(pickle.HIGHEST_PROTOCOL, 5))
+BUFFER_SUFFIX = '.buffers'
+BUFFER_ALIGNMENT = 64
+
+_FOOTER = struct.Struct('<Q')
+
+
+def _buffer_path(filename):
+    return f'{os.fspath(filename)}{BUFFER_SUFFIX}'
+
+
+class _BufferWriter:
+    __slots__ = ['_file', '_offset', '_index']
+
+    def __init__(self, file):
+        self._file = file
+        self._offset = 0
+        self._index = []
+
+    def __call__(self, buffer):
+        data = buffer.raw()
+        padding = -self._offset % BUFFER_ALIGNMENT
+        self._file.write(b'\0' * padding)
+        self._offset += padding
+        self._file.write(data)
+        self._index.append((self._offset, data.nbytes))
+        self._offset += data.nbytes
+
+    def abort(self):
+        self._file.close()
+
+    def close(self):
+        index = pickle.dumps(self._index, PROTOCOL)
+        self._file.write(index)
+        self._file.write(_FOOTER.pack(len(index)))
+        self._file.close()
+
+
+def _read_buffers(filename):
+    with open(filename, 'rb') as f:
+        # copy-on-write mapping: pages are shared until an array is modified
+        view = memoryview(mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_COPY))
+    size, = _FOOTER.unpack(view[-_FOOTER.size:])
+    index = pickle.loads(view[-_FOOTER.size - size:-_FOOTER.size])
+    return [view[offset:offset + nbytes] for offset, nbytes in index]
+
+
+def _remove(path):
+    try:
+        os.remove(path)
+    except FileNotFoundError:
+        pass
+
+
+def dump(obj, filename, pickler=pickle):
+    # both files are written under temporary names and moved into place
+    # only once complete, so a failed dump leaves the previous pair intact
+    buffer_path = _buffer_path(filename)
+    suffix = f'.tmp{os.getpid()}'
+    tmp_path = f'{os.fspath(filename)}{suffix}'
+    tmp_buffer_path = f'{buffer_path}{suffix}'
+    writer = None
+
+    def buffer_callback(buffer):
+        nonlocal writer
+        if writer is None:
+            writer = _BufferWriter(open(tmp_buffer_path, 'wb'))
+        writer(buffer)
+
+    try:
+        with open(tmp_path, 'wb') as f:
+            if PROTOCOL < 5:
+                pickler.dump(obj, f, PROTOCOL)
+            else:
+                pickler.dump(
+                    obj, f, PROTOCOL, buffer_callback=buffer_callback)
+        if writer is not None:
+            writer.close()
+    except BaseException:
+        if writer is not None:
+            writer.abort()
+        _remove(tmp_buffer_path)
+        _remove(tmp_path)
+        raise
+
+    # the sidecar goes first; the pickle is what marks the pair complete
+    if writer is not None:
+        os.replace(tmp_buffer_path, buffer_path)
+    else:
+        _remove(buffer_path)
+    os.replace(tmp_path, filename)
+
+
+def load(filename, pickler=pickle):
+    buffer_path = _buffer_path(filename)
+    if os.path.exists(buffer_path):
+        buffers = _read_buffers(buffer_path)
+    else:
+        buffers = None
+
+    with open(filename, 'rb') as f:
+        if buffers is None:
+            return pickler.load(f)
+        return pickler.load(f, buffers=buffers)
+
+
 def save_pipeline(filename, dataset):
+    import cloudpickle
+
     assert isinstance(dataset, pipelib.core.PipelinedDataset)
 
-    with open(filename, 'wb') as f:
-        cloudpickle.dump(dataset._func, f)
+    dump(dataset._func, filename, cloudpickle)
 
 
 def load_pipeline(filename):
+    import cloudpickle
+
     filepath = Path(filename)
 
     assert filepath.is_file()
 
-    with filepath.open('rb') as f:
-        return cloudpickle.load(f)
+    return load(filepath, cloudpickle)
@@ -0,0 +1,74 @@
+import sys
+import heapq
+import pickle
+import tempfile
+from itertools import islice
+from operator import itemgetter
+
+
+BLOCK_SIZE = 1024
+MAX_RUNS = 128
+
+_get_key = itemgetter(0)
+
+
+def _write_run(pairs):
+    f = tempfile.TemporaryFile()
+    for block in iter(lambda: list(islice(pairs, BLOCK_SIZE)), []):
+        pickle.dump(block, f, pickle.HIGHEST_PROTOCOL)
+    f.seek(0)
+    return f
+
+
+def _read_run(f):
+    with f:
+        while True:
+            try:
+                block = pickle.load(f)
+            except EOFError:
+                return
+            yield from block
+
+
+def _merge_runs(runs, reverse):
+    return heapq.merge(*map(_read_run, runs), key=_get_key, reverse=reverse)
+
+
+def external_sort(iterable, key=None, reverse=False, memory_limit=None):
+    if memory_limit is None:
+        yield from sorted(iterable, key=key, reverse=reverse)
+        return
+
+    runs = []
+    run = []
+    size = 0
+    for x in iterable:
+        k = x if key is None else key(x)
+        run.append((k, x))
+        # a shallow estimate; nested containers are undercounted
+        size += sys.getsizeof(x)
+        if size >= memory_limit:
+            run.sort(key=_get_key, reverse=reverse)
+            runs.append(_write_run(iter(run)))
+            run = []
+            size = 0
+
+    run.sort(key=_get_key, reverse=reverse)
+    if not runs:
+        for _, x in run:
+            yield x
+        return
+    if run:
+        runs.append(_write_run(iter(run)))
+    del run
+
+    while len(runs) > MAX_RUNS:
+        # merge consecutive groups so that every pass reads each element
+        # once, and keep the groups in order so that the sort stays stable
+        groups = (runs[i:i + MAX_RUNS] for i in range(0, len(runs), MAX_RUNS))
+        runs = [group[0] if len(group) == 1
+                else _write_run(_merge_runs(group, reverse))
+                for group in groups]
+
+    for _, x in _merge_runs(runs, reverse):
+        yield x
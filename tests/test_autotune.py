@@ -0,0 +1,59 @@
+from unittest import TestCase
+
+from pipelib import autotune
+
+
+class AutotuneTestCase(TestCase):
+
+    def test_parallelism_tuner(self):
+        budget = autotune.Budget(4)
+        # each tuner takes its first core when it starts
+        tuner = autotune.ParallelismTuner(limit=8, budget=budget)
+        other = autotune.ParallelismTuner(limit=8, budget=budget)
+        self.assertEqual(tuner.parallelism, 1)
+
+        for _ in range(10):
+            tuner.record(True, 0)
+        # the budget is exhausted after two more cores
+        self.assertEqual(tuner.parallelism, 3)
+        self.assertEqual(tuner.max_pending, 6)
+        other.record(True, 0)
+        self.assertEqual(other.parallelism, 1)
+
+        # a consumer-bound stage hands cores back to the others
+        tuner.record(False, 5)
+        self.assertEqual(tuner.parallelism, 2)
+        other.record(True, 0)
+        self.assertEqual(other.parallelism, 2)
+
+        tuner.close()
+        other.close()
+        self.assertEqual(tuner.parallelism, 1)
+        self.assertEqual(sum(budget.acquire() for _ in range(10)), 4)
+
+        # without a core left a stage still runs, and gives back only the
+        # cores it took later
+        budget = autotune.Budget(1)
+        tuner = autotune.ParallelismTuner(limit=8, budget=budget)
+        other = autotune.ParallelismTuner(limit=8, budget=budget)
+        other.record(True, 0)
+        self.assertEqual(other.parallelism, 1)
+        tuner.close()
+        other.record(True, 0)
+        self.assertEqual(other.parallelism, 2)
+        other.close()
+        self.assertEqual(sum(budget.acquire() for _ in range(10)), 1)
+
+        tuner = autotune.ParallelismTuner(limit=2, budget=autotune.Budget(8))
+        for _ in range(10):
+            tuner.record(True, 0)
+        self.assertEqual(tuner.parallelism, 2)
+
+    def test_buffer_tuner(self):
+        tuner = autotune.BufferTuner(memory_limit=1000)
+        tuner.record(False, 'x' * 50)
+        self.assertEqual(tuner.size, 1)
+        for _ in range(10):
+            tuner.record(True, 'x' * 50)
+        self.assertGreater(tuner.size, 1)
+        self.assertLessEqual(tuner.size * tuner._item_size, 1000)
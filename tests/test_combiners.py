@@ -0,0 +1,57 @@
+from unittest import TestCase
+from operator import add
+from collections import Counter
+
+from pipelib import combiners
+
+
+class CombinersTestCase(TestCase):
+
+    def setUp(self):
+        self.data = range(100)
+
+    def check_split_merge(self, combiner, expected):
+        accumulator = combiner.add_all(combiner.create(), self.data[:30])
+        other = combiner.create()
+        for x in self.data[30:]:
+            other = combiner.add(other, x)
+        accumulator = combiner.merge(accumulator, other)
+
+        self.assertEqual(combiner.result(accumulator), expected)
+
+    def test_reduce(self):
+        combiner = combiners.Reduce(add, 0)
+        self.check_split_merge(combiner, sum(self.data))
+
+        combiner = combiners.Reduce(add, 100)
+        self.check_split_merge(combiner, 100 + sum(self.data))
+        self.assertEqual(combiner.result(combiner.create()), 100)
+
+        combiner = combiners.Reduce(lambda acc, x: acc + [x], [-1], add, [])
+        self.check_split_merge(combiner, [-1] + list(self.data))
+
+        with self.assertRaises(ValueError):
+            combiners.Reduce(lambda acc, x: acc + [x], [], add)
+
+        def append(acc, x):
+            acc.append(x)
+            return acc
+
+        def extend(acc, other):
+            acc.extend(other)
+            return acc
+
+        combiner = combiners.Reduce(append, [-1], extend, [])
+        self.check_split_merge(combiner, [-1] + list(self.data))
+        self.check_split_merge(combiner, [-1] + list(self.data))
+
+    def test_count_by(self):
+        combiner = combiners.CountBy(lambda x: x % 3)
+        self.check_split_merge(combiner, Counter(x % 3 for x in self.data))
+
+        combiner = combiners.CountBy()
+        self.check_split_merge(combiner, Counter(self.data))
+
+        combiner = combiners.CountBy(lambda x: [x % 3, x % 5], flat=True)
+        self.check_split_merge(combiner, Counter(
+            [x % 3 for x in self.data] + [x % 5 for x in self.data]))
@@ -1,9 +1,16 @@
 from unittest import TestCase
-from unittest.mock import patch, Mock
+from unittest.mock import patch
+import os
+import time
 import tempfile
-from itertools import chain
+import threading
+from pathlib import Path
+from itertools import chain, islice
+from collections import Counter
+from operator import add
 
 import pipelib
+from pipelib import listing
 from pipelib import Dataset, TextDataset, DirDataset
 
 
@@ -42,6 +49,10 @@ class DatasetTestCase(TestCase):
         self.check_for_loop(data, expected)
         self.check_correct_pipelined_dataset(data, self.base, nested=False)
 
+        self.assertListEqual(Dataset([]).repeat().all(), [])
+        self.assertListEqual(
+            list(Dataset([]).repeat().get_resumable_iterator()), [])
+
     def test_shuffle(self):
         data = self.data.shuffle(100)
         expected = list(self.base)
@@ -104,6 +115,33 @@ class DatasetTestCase(TestCase):
         self.check_for_loop(data, expected)
         self.check_correct_pipelined_dataset(data, self.base, nested=False)
 
+    def test_sort_by(self):
+        def f(x):
+            return -x
+
+        expected = sorted(self.base, key=f)
+
+        data = self.data.sort_by(f)
+        self.assertListEqual(data.all(), expected)
+        self.check_correct_pipelined_dataset(data, self.base, nested=False)
+
+        data = self.data.sort_by(f, memory_limit=100)
+        self.assertListEqual(data.all(), expected)
+
+        data = self.data.sort_by(f, reverse=True, memory_limit=100)
+        self.assertListEqual(data.all(), list(self.base))
+
+    def test_distinct(self):
+        data = self.data.map(lambda x: x % 10)
+        expected = list(range(10))
+
+        self.assertListEqual(data.distinct().all(), expected)
+        self.assertListEqual(data.distinct(exact=False).all(), expected)
+        self.assertListEqual(
+            self.data.distinct(key=lambda x: x % 10).all(), expected)
+        self.check_correct_pipelined_dataset(
+            data.distinct(), self.base)
+
     def test_map_parallel(self):
         def f(x):
             return x ** 2
@@ -154,6 +192,12 @@ class DatasetTestCase(TestCase):
 
         self.check_correct_pipelined_dataset(data, self.base)
 
+        expected = list(zip(data1, data2))
+        self.assertListEqual(data1.zip(data2, n_prefetch=4).all(), expected)
+        self.assertListEqual(
+            data1.zip(data2, Dataset(range(10)), n_prefetch=pipelib.AUTOTUNE)
+            .all(), [(x, y, z) for (x, y), z in zip(expected, range(10))])
+
     def test_concat(self):
         data1 = self.data.map(lambda x: x ** 2)
         data2 = self.data.map(lambda x: x / 2)
@@ -165,6 +209,37 @@ class DatasetTestCase(TestCase):
 
         self.check_correct_pipelined_dataset(data, self.base)
 
+        data = data1.concat(data2, Dataset([]), data1, n_prefetch=2)
+        self.assertListEqual(data.all(), expected + expected[:100])
+        self.assertListEqual(data.take(150), expected[:150])
+
+    def test_prefetch_threads(self):
+        def slow(x):
+            time.sleep(0.02)
+            return x
+
+        def fail(x):
+            raise ValueError(x)
+
+        data = self.data.map(slow)
+        start = time.perf_counter()
+        result = data.zip(data, data, n_prefetch=2).take(20)
+        # the inputs are read concurrently instead of one after another,
+        # which would take 1.2 seconds
+        self.assertLess(time.perf_counter() - start, 0.9)
+        self.assertListEqual(result, [(x, x, x) for x in range(20)])
+
+        # stopping early leaves no producer threads behind
+        n_threads = threading.active_count()
+        for _ in range(5):
+            self.data.repeat().concat(self.data, n_prefetch=2).take(10)
+            self.data.repeat().zip(self.data, n_prefetch=2).take(10)
+        time.sleep(0.1)
+        self.assertLessEqual(threading.active_count(), n_threads)
+
+        with self.assertRaises(ValueError):
+            self.data.zip(self.data.map(fail), n_prefetch=1).all()
+
     def test_method_chain(self):
         data = self.data.map(lambda x: x ** 2) \
             .filter(lambda x: x % 2 == 0) \
@@ -184,6 +259,148 @@ class DatasetTestCase(TestCase):
         for x, y in zip(it, self.base):
             self.assertEqual(x, y)
 
+        it = self.data.get_prefetch_iterator(n_prefetch=pipelib.AUTOTUNE)
+        self.assertListEqual(list(it), list(self.base))
+        # the buffer size is bounded by the memory limit
+        it = self.data.get_prefetch_iterator(pipelib.AUTOTUNE, memory_limit=1)
+        self.assertListEqual(list(it), list(self.base))
+        self.assertEqual(it._queue.maxsize, 1)
+
+    def test_get_resumable_iterator(self):
+        data = self.data.map(lambda x: x ** 2) \
+            .filter(lambda x: x % 2 == 0) \
+            .zip(self.data.window(2)) \
+            .concat(self.data.map(lambda x: (x, x))) \
+            .flat_map(lambda x: [x, x]) \
+            .batch(3) \
+            .repeat()
+
+        it = data.get_resumable_iterator()
+        self.assertListEqual(list(islice(it, 100)), data.take(100))
+
+        data = data.shuffle(10)
+        it = data.get_resumable_iterator()
+
+        for _ in range(123):
+            next(it)
+        state = it.get_state()
+        expected = list(islice(it, 100))
+
+        it = data.get_resumable_iterator(state)
+        self.assertListEqual(list(islice(it, 100)), expected)
+
+        with self.assertRaises(TypeError):
+            self.data.map_parallel(lambda x: x).get_resumable_iterator()
+
+        with self.assertRaises(TypeError):
+            self.data.apply(lambda x: x).get_resumable_iterator()
+
+    def test_reduce(self):
+        self.assertEqual(self.data.reduce(add, 0), sum(self.base))
+        self.assertEqual(self.data.reduce_parallel(add, 0, chunksize=10),
+                         sum(self.base))
+
+        self.assertEqual(self.data.reduce(add, 100), 100 + sum(self.base))
+        self.assertEqual(self.data.reduce_parallel(add, 100, chunksize=3),
+                         100 + sum(self.base))
+        self.assertEqual(Dataset([]).reduce_parallel(add, 100), 100)
+
+        def f(acc, x):
+            return acc + len(x)
+
+        data = self.data.map(str)
+        expected = data.reduce(f, 100)
+        self.assertEqual(data.reduce_parallel(f, 100, combine=add, identity=0,
+                                              chunksize=7),
+                         expected)
+
+        # accumulators updated in place get a fresh identity per chunk
+        data = Dataset(range(10))
+        for _ in range(2):
+            result = data.reduce_parallel(
+                lambda acc, x: acc.append(x) or acc, [],
+                combine=lambda acc, other: acc.extend(other) or acc,
+                identity=[], n=1, chunksize=3)
+            self.assertListEqual(result, list(range(10)))
+
+    def test_count_by(self):
+        expected = Counter(x % 3 for x in self.base)
+
+        self.assertEqual(self.data.count_by(lambda x: x % 3), expected)
+        self.assertEqual(self.data.map(lambda x: x % 3).count_by(), expected)
+        self.assertEqual(self.data.count_by_parallel(lambda x: x % 3,
+                                                     chunksize=10),
+                         expected)
+
+        lines = Dataset(['a b a', '', 'c b'] * 10)
+        expected = Counter({'a': 20, 'b': 20, 'c': 10})
+        self.assertEqual(lines.count_by(str.split, flat=True), expected)
+        self.assertEqual(lines.count_by_parallel(str.split, chunksize=4,
+                                                 flat=True),
+                         expected)
+        with self.assertRaises(ValueError):
+            lines.count_by(flat=True)
+
+    def test_aggregate(self):
+        combiner = pipelib.combiners.CountBy(lambda x: x % 2)
+        expected = Counter(x % 2 for x in self.base)
+
+        self.assertEqual(self.data.aggregate(combiner), expected)
+        self.assertEqual(self.data.aggregate_parallel(combiner, n=2),
+                         expected)
+
+    def test_cardinality(self):
+        n = len(self.base)
+        cases = [
+            (self.data, n),
+            (self.data.map(lambda x: x), n),
+            (self.data.shuffle(10), n),
+            (self.data.sort_by(lambda x: -x), n),
+            (self.data.batch(16), 7),
+            (self.data.window(3), n - 2),
+            (self.data.map_parallel(lambda x: x), n),
+            (self.data.zip(self.data.batch(10)), 10),
+            (self.data.zip(self.data.repeat()), n),
+            (self.data.concat(self.data, self.data), 3 * n),
+            (self.data.filter(lambda x: True), pipelib.UNKNOWN),
+            (self.data.flat_map(lambda x: [x]), pipelib.UNKNOWN),
+            (self.data.filter_parallel(lambda x: True), pipelib.UNKNOWN),
+            (self.data.apply(lambda x: x), pipelib.UNKNOWN),
+            (self.data.filter(lambda x: True).map(lambda x: x),
+             pipelib.UNKNOWN),
+            (self.data.concat(self.data.filter(lambda x: True)),
+             pipelib.UNKNOWN),
+            (self.data.repeat(), pipelib.INFINITE),
+            (self.data.repeat().batch(3).map(lambda x: x), pipelib.INFINITE),
+            (self.data.concat(self.data.repeat()), pipelib.INFINITE),
+            (Dataset([]).repeat(), 0),
+            (Dataset([]).filter(lambda x: True), 0),
+            (self.data.filter(lambda x: True).repeat(), pipelib.INFINITE),
+        ]
+        for data, expected in cases:
+            self.assertEqual(data.cardinality(), expected)
+            if expected >= 0:
+                self.assertEqual(len(data), expected)
+                self.assertEqual(len(data.all()), expected)
+            else:
+                with self.assertRaises(TypeError):
+                    len(data)
+            self.assertTrue(data)
+
+        with self.assertRaises(ValueError):
+            self.data.repeat().all()
+        with self.assertRaises(ValueError):
+            self.data.filter(lambda x: True).repeat().all()
+        # an unknown source that turns out to be empty still ends repeat()
+        self.assertListEqual(
+            list(Dataset([]).filter(lambda x: True).repeat()), [])
+
+        tempdir = tempfile.TemporaryDirectory()
+        data = self.data.map(lambda x: x).save(f'{tempdir.name}/dataset')
+        self.assertEqual(len(data), n)
+        self.assertEqual(len(data.map(str)), n)
+        tempdir.cleanup()
+
     def test_all(self):
         data = self.data
         expected = list(self.base)
@@ -203,20 +420,42 @@ class DatasetTestCase(TestCase):
 
         self.assertListEqual(data, expected)
 
-    @patch('pipelib.core.open')
-    @patch('pipelib.core.pickle.dump')
-    def test_save(self, pickle_dump_mock, open_mock):
-        enter_mock = Mock()
-        # mock file object
-        open_mock.return_value.__enter__.return_value = enter_mock
+    def test_getitem(self):
+        data = Dataset(list(self.base)).map(lambda x: x * 2) \
+            .map_parallel(lambda x: x + 1)
+        self.assertEqual(data[10], 21)
+        self.assertEqual(data[-1], 199)
+        with self.assertRaises(IndexError):
+            data[100]
+        for index in (slice(0, 2), 1.0, '1'):
+            with self.assertRaises(TypeError):
+                data[index]
+        with self.assertRaises(TypeError):
+            Dataset([1, 2, 3]).map(lambda x: x * 2)[0:2]
+
+        tempdir = tempfile.TemporaryDirectory()
+        with patch('pipelib.serializers.dump'):
+            cache = self.data.map(lambda x: x * 2).save(
+                f'{tempdir.name}/dataset')
+        self.assertEqual(cache[10], 20)
+        self.assertEqual(cache.map(lambda x: x + 1)[10], 21)
+        tempdir.cleanup()
+
+        for op in (lambda d: d.filter(bool), lambda d: d.flat_map(list),
+                   lambda d: d.filter_parallel(bool), lambda d: d.batch(2),
+                   lambda d: d.apply(lambda x: x)):
+            with self.assertRaises(TypeError):
+                op(self.data)[0]
+        with self.assertRaises(TypeError):
+            Dataset(iter(self.base)).map(abs)[0]
 
+    @patch('pipelib.serializers.dump')
+    def test_save(self, dump_mock):
         filepath = '/path/to/dataset'
         data = self.data.filter(lambda x: x % 2 == 0) \
             .map(lambda x: x ** 2) \
             .save(filepath)
-        open_mock.assert_called_once_with(filepath, 'wb')
-        pickle_dump_mock.assert_called_once_with(
-            data.all(), enter_mock)
+        dump_mock.assert_called_once_with(data.all(), filepath)
 
         expected = [x ** 2 for x in self.base if x % 2 == 0]
         self.assertListEqual(data.all(), expected)
@@ -230,21 +469,27 @@ class DatasetTestCase(TestCase):
         self.assertListEqual(result, expected)
         self.check_correct_pipelined_dataset(data, self.base)
 
-    @patch('pipelib.core.open')
-    @patch('pipelib.core.pickle.load')
-    def test_load(self, pickle_load_mock, open_mock):
-        pickle_load_mock.return_value = list(self.base)
-        enter_mock = Mock()
-        open_mock.return_value.__enter__.return_value = enter_mock
+    @patch('pipelib.serializers.load')
+    def test_load(self, load_mock):
+        load_mock.return_value = list(self.base)
 
         filepath = '/path/to/dataset'
         data = Dataset.load(filepath)
-        open_mock.assert_called_once_with(filepath, 'rb')
-        pickle_load_mock.assert_called_once_with(enter_mock)
+        load_mock.assert_called_once_with(filepath)
 
         self.assertListEqual(data.all(), list(self.base))
         self.assertEqual(data._dataset, list(self.base))
 
+    def test_save_load(self):
+        tempdir = tempfile.TemporaryDirectory()
+        filepath = f'{tempdir.name}/dataset'
+
+        expected = [x ** 2 for x in self.base]
+        self.data.map(lambda x: x ** 2).save(filepath)
+        self.assertListEqual(Dataset.load(filepath).all(), expected)
+
+        tempdir.cleanup()
+
 
 class TextDatasetTestCase(TestCase):
     def test_text(self):
@@ -271,11 +516,70 @@ class TextDatasetTestCase(TestCase):
 
         fp.close()
 
+    def test_random_access(self):
+        tempdir = tempfile.TemporaryDirectory()
+        filepath = f'{tempdir.name}/text.txt'
+        lines = ['first', 'caf\xe9', '', 'last']
+        with open(filepath, 'w', encoding='utf-8', newline='') as f:
+            f.write('first\ncaf\xe9\r\n\nlast')
+
+        data = TextDataset(filepath, random_access=True)
+        self.assertEqual(len(data), 4)
+        self.assertListEqual([data[i] for i in range(4)], lines)
+        self.assertListEqual(data.all(), lines)
+        self.assertEqual(data.map(str.upper)[1], 'CAF\xc9')
+
+        with self.assertRaises(TypeError):
+            TextDataset(filepath)[0]
+        with self.assertRaises(TypeError):
+            data[0:2]
+
+        # the same cases as sequential iteration handles
+        cases = [('utf-16', 'ab\ncd\n'),
+                 ('utf-8', 'a\rb\rc'),
+                 ('utf-8', 'a\r\nb\rc\n'),
+                 ('latin-1', 'caf\xe9\r\nna\xefve\r\n'),
+                 ('shift_jis', '\u3042\n\u3044\n')]
+        for i, (encoding, text) in enumerate(cases):
+            filepath = f'{tempdir.name}/{i}.txt'
+            with open(filepath, 'w', encoding=encoding, newline='') as f:
+                f.write(text)
+
+            data = TextDataset(filepath, encoding, random_access=True)
+            expected = TextDataset(filepath, encoding).all()
+            self.assertEqual(len(data), len(expected))
+            self.assertListEqual([data[i] for i in range(len(data))],
+                                 expected)
+            self.assertEqual(data[-1], expected[-1])
+
+        tempdir.cleanup()
+
+    def test_resumable_matches_iteration(self):
+        tempdir = tempfile.TemporaryDirectory()
+        cases = [('utf-16', 'first\nsecond line\n\u3042\u3044\n'),
+                 ('utf-8', 'a\rb\r\nc\rd'),
+                 ('latin-1', 'caf\xe9\nna\xefve\n')]
+        for i, (encoding, text) in enumerate(cases):
+            filepath = f'{tempdir.name}/{i}.txt'
+            with open(filepath, 'w', encoding=encoding, newline='') as f:
+                f.write(text)
+
+            data = TextDataset(filepath, encoding=encoding)
+            expected = data.all()
+            self.assertListEqual(list(data.get_resumable_iterator()),
+                                 expected)
+
+            it = data.get_resumable_iterator()
+            next(it)
+            it = data.get_resumable_iterator(it.get_state())
+            self.assertListEqual(list(it), expected[1:])
+
+        tempdir.cleanup()
+
 
 class DirDatasetTestCase(TestCase):
     def test_directory(self):
         tempdir = tempfile.TemporaryDirectory()
-        from pathlib import Path
         expected = []
         dirpath = Path(tempdir.name)
         for i in range(10):
@@ -301,3 +605,43 @@ class DirDatasetTestCase(TestCase):
         self.assertIsInstance(data._func, pipelib.core._NestedFunc)
 
         tempdir.cleanup()
+
+    def test_directory_index(self):
+        tempdir = tempfile.TemporaryDirectory()
+        dirpath = Path(tempdir.name)
+        (dirpath / 'sub').mkdir()
+        for i in range(10):
+            (dirpath / 'sub' / f'{i:03d}.txt').touch()
+        expected = [str(dirpath / 'sub' / f'{i:03d}.txt') for i in range(10)]
+
+        index_path = f'{tempdir.name}/index'
+        data = DirDataset(tempdir.name, pattern='**/*.txt',
+                          index_path=index_path)
+        self.assertListEqual(data.all(), expected)
+        self.assertListEqual(data.map(str.upper).all(),
+                             [x.upper() for x in expected])
+        self.assertListEqual(data.shard(3, 1).all(), expected[1::3])
+        self.assertListEqual(list(data.get_resumable_iterator(4)),
+                             expected[4:])
+        self.assertEqual(data[3], expected[3])
+        self.assertEqual(data.map(str.upper)[-1], expected[-1].upper())
+
+        data = DirDataset(tempdir.name, pattern='**/*.txt',
+                          index_path=index_path)
+        with patch('pipelib.listing.DirectoryIndex.build') as build_mock:
+            self.assertListEqual(data.all(), expected)
+        build_mock.assert_not_called()
+
+        (dirpath / 'sub' / 'new.txt').touch()
+        os.utime(dirpath / 'sub', ns=(0, 0))
+        self.assertIn(str(dirpath / 'sub' / 'new.txt'), data.all())
+
+        # a corrupt index file is rebuilt instead of failing the dataset
+        with open(index_path, 'wb') as f:
+            f.write(b'garbage')
+        data = DirDataset(tempdir.name, pattern='**/*.txt',
+                          index_path=index_path)
+        self.assertEqual(len(data.all()), 11)
+        self.assertEqual(len(listing.DirectoryIndex.load(index_path)), 11)
+
+        tempdir.cleanup()
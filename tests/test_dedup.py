@@ -0,0 +1,70 @@
+from unittest import TestCase
+import random
+
+from pipelib import dedup
+
+
+class DedupTestCase(TestCase):
+
+    def setUp(self):
+        rng = random.Random(0)
+        self.data = [rng.randrange(500) for _ in range(2000)]
+        self.expected = list(dict.fromkeys(self.data))
+
+    def test_fingerprint(self):
+        self.assertEqual(dedup.fingerprint('abc'), dedup.fingerprint('abc'))
+        self.assertEqual(dedup.fingerprint((1, 'a')),
+                         dedup.fingerprint((1, 'a')))
+        self.assertNotEqual(dedup.fingerprint('abc'),
+                            dedup.fingerprint(b'abc'))
+        self.assertLess(dedup.fingerprint([1, 2, 3]), 2 ** 64)
+
+        equal = [(1, 1.0), (1, True),
+                 ({'a': 1, 'b': [2.0]}, {'b': [2], 'a': 1}),
+                 (b'ab', bytearray(b'ab')), ({1, 'a'}, frozenset(['a', 1])),
+                 (0.0, -0.0)]
+        for x, y in equal:
+            self.assertEqual(x, y)
+            self.assertEqual(dedup.fingerprint(x), dedup.fingerprint(y))
+
+        different = [('1', 1), ([1, 2], (1, 2)), (('a', 'b'), ('ab',)),
+                     ([['a'], 'b'], [['a', 'b']]), (0.5, 1), ({1: 2}, {2: 1})]
+        for x, y in different:
+            self.assertNotEqual(x, y)
+            self.assertNotEqual(dedup.fingerprint(x), dedup.fingerprint(y))
+
+    def test_fingerprint_set(self):
+        seen = dedup.FingerprintSet(capacity=4)
+        fps = [dedup.fingerprint(x) for x in self.data]
+        added = [seen.add(fp) for fp in fps]
+
+        self.assertEqual(sum(added), len(self.expected))
+        self.assertEqual(len(seen), len(self.expected))
+        self.assertTrue(all(fp in seen for fp in fps))
+        self.assertNotIn(dedup.fingerprint(-1), seen)
+        self.assertTrue(seen.add(0))
+        self.assertFalse(seen.add(0))
+
+    def test_bloom_filter(self):
+        seen = dedup.ScalableBloomFilter(capacity=100, error_rate=0.01)
+        added = sum(seen.add(dedup.fingerprint(x)) for x in range(1000))
+        self.assertGreater(added, 1000 * 0.99)
+        for x in range(1000):
+            self.assertIn(dedup.fingerprint(x), seen)
+
+        false_positives = sum(dedup.fingerprint(x) in seen
+                              for x in range(1000, 11000))
+        self.assertLess(false_positives, 10000 * 0.01 * 2)
+
+    def test_distinct(self):
+        self.assertListEqual(list(dedup.distinct(self.data)), self.expected)
+
+        expected = {}
+        for x in self.data:
+            expected.setdefault(x % 10, x)
+        result = dedup.distinct(self.data, key=lambda x: x % 10)
+        self.assertListEqual(list(result), list(expected.values()))
+
+        seen = dedup.get_seen_set(exact=False, error_rate=1e-6, capacity=100)
+        self.assertListEqual(list(dedup.distinct(self.data, seen=seen)),
+                             self.expected)
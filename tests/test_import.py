@@ -0,0 +1,36 @@
+from unittest import TestCase, skipIf
+import re
+import sys
+import subprocess
+
+
+HEAVY_MODULES = ['multiprocess', 'dill', 'cloudpickle',
+                 'pipelib.parallel', 'pipelib.serializers']
+
+
+def run_python(code, *options):
+    return subprocess.run([sys.executable, *options, '-c', code],
+                          stdout=subprocess.PIPE, stderr=subprocess.PIPE,
+                          universal_newlines=True, check=True)
+
+
+def import_time(module):
+    # cumulative microseconds reported by -X importtime, best of three
+    def measure():
+        stderr = run_python(f'import {module}', '-X', 'importtime').stderr
+        pattern = rf'\|\s*(\d+) \| {re.escape(module)}$'
+        return int(re.search(pattern, stderr, re.MULTILINE).group(1))
+    return min(measure() for _ in range(3))
+
+
+class ImportTestCase(TestCase):
+
+    def test_no_heavy_imports(self):
+        code = ('import sys, pipelib\n'
+                f'print(*[m for m in {HEAVY_MODULES!r} if m in sys.modules])')
+        self.assertEqual(run_python(code).stdout.strip(), '')
+
+    @skipIf(sys.version_info < (3, 7), '-X importtime requires Python 3.7')
+    def test_import_time(self):
+        # relative to the dependency it defers, so that machine speed cancels
+        self.assertLess(import_time('pipelib'), import_time('multiprocess'))
@@ -1,4 +1,6 @@
 from unittest import TestCase
+import tempfile
+from itertools import chain, islice
 
 from pipelib import iterators
 
@@ -15,3 +17,108 @@ class IteratorsTestCase(TestCase):
         for _ in range(repeat):
             for x, y in zip(self.data, it):
                 self.assertEqual(x, y)
+
+    def check_resume(self, make_iterator, n_consumed=37, n_rest=50):
+        it = make_iterator()
+        for _ in range(n_consumed):
+            next(it)
+        state = it.get_state()
+        expected = list(islice(it, n_rest))
+
+        it = make_iterator()
+        it.set_state(state)
+        self.assertListEqual(list(islice(it, n_rest)), expected)
+
+    def test_sequence_iterator(self):
+        it = iterators.get_resumable_iterator(self.data)
+        self.assertIsInstance(it, iterators.SequenceIterator)
+        self.assertListEqual(list(it), list(self.data))
+
+        self.check_resume(lambda: iterators.SequenceIterator(self.data))
+
+    def test_iterable_iterator(self):
+        data = {x: None for x in self.data}
+        it = iterators.get_resumable_iterator(data)
+        self.assertIsInstance(it, iterators.IterableIterator)
+        self.assertListEqual(list(it), list(self.data))
+
+        self.check_resume(lambda: iterators.IterableIterator(data))
+
+        with self.assertRaises(TypeError):
+            iterators.get_resumable_iterator(iter(self.data))
+
+    def test_text_iterator(self):
+        fp = tempfile.NamedTemporaryFile()
+        for x in self.data:
+            fp.write(f'line {x}\n'.encode('utf-8'))
+        fp.flush()
+
+        it = iterators.TextIterator(fp.name)
+        self.assertListEqual(list(it), [f'line {x}' for x in self.data])
+        it.reset()
+        self.assertEqual(next(it), 'line 0')
+
+        self.check_resume(lambda: iterators.TextIterator(fp.name))
+
+        fp.close()
+
+    def test_repeat_iterator(self):
+        def make_iterator():
+            return iterators.RepeatIterator(
+                iterators.SequenceIterator(self.data))
+
+        it = make_iterator()
+        expected = list(self.data) * 2 + list(range(50))
+        self.assertListEqual(list(islice(it, 250)), expected)
+        self.assertEqual(it.get_state(), (2, 50))
+
+        self.check_resume(make_iterator, n_consumed=150, n_rest=200)
+
+    def test_batch_iterator(self):
+        def make_iterator():
+            return iterators.BatchIterator(
+                iterators.SequenceIterator(self.data), 16)
+
+        it = make_iterator()
+        self.assertListEqual(list(chain.from_iterable(it)), list(self.data))
+
+        self.check_resume(make_iterator, n_consumed=3)
+
+    def test_shuffle_iterator(self):
+        def make_iterator():
+            return iterators.ShuffleIterator(
+                iterators.SequenceIterator(self.data), 30)
+
+        self.assertListEqual(sorted(make_iterator()), list(self.data))
+
+        self.check_resume(make_iterator, n_consumed=45)
+
+    def test_window_iterator(self):
+        def make_iterator():
+            return iterators.WindowIterator(
+                iterators.SequenceIterator(self.data), 3)
+
+        expected = list(zip(*(self.data[i:] for i in range(3))))
+        self.assertListEqual(list(make_iterator()), expected)
+
+        self.check_resume(make_iterator)
+
+    def test_flat_map_iterator(self):
+        def make_iterator():
+            return iterators.FlatMapIterator(
+                iterators.SequenceIterator(self.data), lambda x: [x] * 3)
+
+        expected = [x for x in self.data for _ in range(3)]
+        self.assertListEqual(list(make_iterator()), expected)
+
+        self.check_resume(make_iterator, n_consumed=38)
+
+    def test_chain_iterator(self):
+        def make_iterator():
+            return iterators.ChainIterator(
+                iterators.SequenceIterator(self.data),
+                iterators.SequenceIterator(self.data))
+
+        self.assertListEqual(list(make_iterator()), list(self.data) * 2)
+
+        self.check_resume(make_iterator, n_consumed=120)
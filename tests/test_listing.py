@@ -0,0 +1,80 @@
+from unittest import TestCase, skipIf
+import os
+import tempfile
+from pathlib import Path
+
+from pipelib import listing
+
+
+class ListingTestCase(TestCase):
+
+    def setUp(self):
+        self.tempdir = tempfile.TemporaryDirectory()
+        self.dirpath = Path(self.tempdir.name)
+        for d in ('a', 'b', 'a/c'):
+            (self.dirpath / d).mkdir()
+            for i in range(3):
+                (self.dirpath / d / f'{i}.txt').touch()
+                (self.dirpath / d / f'{i}.jpg').touch()
+        (self.dirpath / 'top.txt').write_text('hello')
+
+    def tearDown(self):
+        self.tempdir.cleanup()
+
+    def check_walk(self, pattern, **kwargs):
+        expected = sorted(str(p) for p in self.dirpath.glob(pattern))
+        result = listing.walk(self.dirpath, pattern, **kwargs)
+        self.assertListEqual(sorted(result), expected)
+
+    def test_walk(self):
+        for pattern in ('*', '*.txt', '*/*.jpg', 'a/*/*', '**/*.txt',
+                        'a/**/*.jpg', '**'):
+            self.check_walk(pattern)
+            self.check_walk(pattern, n_threads=4)
+
+        with self.assertRaises(ValueError):
+            list(listing.walk(self.dirpath, ''))
+
+    def test_directory_index(self):
+        index = listing.DirectoryIndex.build(self.dirpath, '**/*.txt')
+        expected = sorted(str(p) for p in self.dirpath.glob('**/*.txt'))
+
+        self.assertListEqual(index.paths, expected)
+        self.assertEqual(len(index), len(expected))
+        self.assertEqual(index.sizes[expected.index(
+            str(self.dirpath / 'top.txt'))], 5)
+        self.assertTrue(index.is_fresh())
+
+        index_path = str(self.dirpath / 'index')
+        index.save(index_path)
+        loaded = listing.DirectoryIndex.load(index_path)
+        self.assertListEqual(loaded.paths, expected)
+        self.assertTrue(loaded.is_fresh())
+
+        (self.dirpath / 'a' / 'c' / 'new.txt').touch()
+        os.utime(self.dirpath / 'a' / 'c', ns=(0, 0))
+        self.assertFalse(loaded.is_fresh())
+
+        # saving again leaves no temporary files behind
+        loaded.save(index_path)
+        self.assertListEqual(sorted(os.listdir(self.dirpath)),
+                             ['a', 'b', 'index', 'top.txt'])
+
+    @skipIf(os.name != 'posix' or os.geteuid() == 0,
+            'permissions are not enforced')
+    def test_walk_unreadable(self):
+        (self.dirpath / 'b').chmod(0)
+        try:
+            expected = sorted(str(p) for p in self.dirpath.glob('**/*.txt')
+                              if p.parent.name != 'b')
+            for n_threads in (None, 4):
+                self.assertListEqual(sorted(listing.walk(
+                    self.dirpath, '**/*.txt', n_threads)), expected)
+        finally:
+            (self.dirpath / 'b').chmod(0o755)
+
+    def test_scan_vanished(self):
+        matches, jobs = listing._scan_dir(
+            str(self.dirpath / 'missing'), listing.compile_pattern('*'), {})
+        self.assertListEqual(matches, [])
+        self.assertListEqual(jobs, [])
@@ -1,6 +1,25 @@
 from unittest import TestCase
+import os
+import sys
+import subprocess
+from collections import Counter
 
+from pipelib import Dataset, AUTOTUNE
 from pipelib import parallel
+from pipelib import combiners
+
+import multiprocess
+
+
+class CountPickle:
+    n_pickled = 0
+
+    def __call__(self, x):
+        return x
+
+    def __getstate__(self):
+        CountPickle.n_pickled += 1
+        return {}
 
 
 class ParallelTestCase(TestCase):
@@ -51,3 +70,155 @@ class ParallelTestCase(TestCase):
             lambda x: [x], unordered=True)(self.data))
         result.sort()
         self.assertListEqual(result, expected)
+
+    def test_aggregate_parallel(self):
+        combiner = combiners.CountBy(lambda x: x % 7)
+        expected = Counter(x % 7 for x in self.data)
+
+        result = parallel.AggregateParallel(combiner, chunksize=8)(self.data)
+        self.assertEqual(result, expected)
+
+        result = parallel.AggregateParallel(
+            combiners.Reduce(lambda acc, x: acc + [x], [],
+                             lambda x, y: x + y, []),
+            n=2, chunksize=3)(self.data)
+        self.assertListEqual(result, list(self.data))
+
+    def test_func_shipped_once(self):
+        func = CountPickle()
+        CountPickle.n_pickled = 0
+
+        n = 2
+        result = parallel.MapParallel(func, n=n)(self.data)
+        self.assertListEqual(list(result), list(self.data))
+        self.assertLessEqual(CountPickle.n_pickled, n)
+
+        CountPickle.n_pickled = 0
+        result = parallel.FilterParallel(func, n=n)(self.data)
+        self.assertListEqual(list(result), list(self.data[1:]))
+        self.assertLessEqual(CountPickle.n_pickled, n)
+
+    def test_batch_loader(self):
+        data = Dataset(list(self.data)).map(lambda x: x * 2)
+        expected = [[x * 2 for x in self.data[i:i + 8]]
+                    for i in range(0, 100, 8)]
+
+        loader = parallel.BatchLoader(data, 8, n=2, n_prefetch=1)
+        self.assertEqual(loader.cardinality(), 13)
+        self.assertListEqual(list(loader), expected)
+
+        loader = parallel.BatchLoader(data, 8, n=2, collate=tuple,
+                                      shuffle=True, drop_last=True)
+        self.assertEqual(loader.cardinality(), 12)
+        result = list(loader)
+        self.assertEqual(len(result), 12)
+        self.assertTrue(all(isinstance(x, tuple) for x in result))
+        elements = [x for batch in result for x in batch]
+        self.assertEqual(len(set(elements)), 96)
+        self.assertTrue(set(elements) <= set(range(0, 200, 2)))
+
+        batches = data.batch_parallel(8, n=2)
+        self.assertEqual(len(batches), 13)
+        self.assertListEqual(batches.all(), expected)
+
+        with self.assertRaises(TypeError):
+            list(parallel.BatchLoader(Dataset(iter(self.data)), 8))
+        with self.assertRaises(TypeError):
+            list(parallel.BatchLoader(data.filter(bool), 8, n=2))
+
+    def test_stage(self):
+        def pid(x):
+            return x, os.getpid()
+
+        data = Dataset(self.data).map(lambda x: x * 2).map(pid) \
+            .stage(n_prefetch=2, chunksize=8) \
+            .map(lambda x: (x, os.getpid())).stage()
+        self.assertEqual(len(data), 100)
+        result = data.all()
+        self.assertListEqual([x for (x, _), _ in result],
+                             [x * 2 for x in self.data])
+        pids = {(p1, p2) for (_, p1), p2 in result}
+        self.assertEqual(len(pids), 1)
+        p1, p2 = pids.pop()
+        self.assertEqual(len({p1, p2, os.getpid()}), 3)
+
+        # stopping early shuts down all stage processes
+        data = Dataset(self.data).repeat().stage().map(abs).stage()
+        self.assertListEqual(data.take(5), list(self.data[:5]))
+        self.assertListEqual(multiprocess.active_children(), [])
+
+        # a stage blocked writing large elements is shut down too
+        data = Dataset(self.data).map(lambda x: bytes(1 << 20)) \
+            .stage(n_prefetch=2)
+        self.assertEqual(len(data.first()), 1 << 20)
+        self.assertEqual(len(data.map(len).stage().take(3)), 3)
+        self.assertListEqual(multiprocess.active_children(), [])
+
+        def fail(x):
+            raise ValueError(x)
+
+        with self.assertRaises(ValueError):
+            Dataset(self.data).map(fail).stage().all()
+
+    def test_stage_at_exit(self):
+        # an iterator still alive at interpreter exit doesn't keep its
+        # stage process running
+        code = ('from pipelib import Dataset\n'
+                'it = iter(Dataset(range(100)).map(lambda x: bytes(1 << 20))'
+                '.stage())\n'
+                'next(it)\n')
+        root = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+        subprocess.run([sys.executable, '-c', code], cwd=root, check=True,
+                       timeout=30)
+
+    def test_autotune(self):
+        expected = [x ** 2 for x in self.data]
+        result = parallel.MapParallel(lambda x: x ** 2, AUTOTUNE,
+                                      chunksize=4)(self.data)
+        self.assertListEqual(list(result), expected)
+        result = parallel.MapParallel(lambda x: x ** 2, AUTOTUNE,
+                                      unordered=True)(self.data)
+        self.assertListEqual(sorted(result), expected)
+
+        result = parallel.FilterParallel(lambda x: x % 2, AUTOTUNE,
+                                         unordered=True)(self.data)
+        self.assertListEqual(sorted(result), list(self.data[1::2]))
+
+        combiner = combiners.CountBy(lambda x: x % 7)
+        result = parallel.AggregateParallel(combiner, AUTOTUNE, 8)(self.data)
+        self.assertEqual(result, Counter(x % 7 for x in self.data))
+
+        def fail(x):
+            raise ValueError(x)
+
+        with self.assertRaises(ValueError):
+            list(parallel.MapParallel(fail, AUTOTUNE, unordered=True)(
+                self.data))
+
+    def test_lazy_submission(self):
+        consumed = []
+
+        def source():
+            for x in range(10000):
+                consumed.append(x)
+                yield x
+
+        result = parallel.MapParallel(abs, n=4)(source())
+        self.assertListEqual([next(result) for _ in range(3)], [0, 1, 2])
+        result.close()
+        # work is submitted as results are consumed, not ahead of time
+        self.assertLessEqual(len(consumed), 8)
+
+        with parallel._get_pool(4, abs) as p:
+            self.assertEqual(p.apply_async(parallel._call_worker_func,
+                                           (-1,)).get(), 1)
+            # workers are only started for outstanding tasks
+            self.assertEqual(len(p._workers), 1)
+        self.assertListEqual(multiprocess.active_children(), [])
+
+    def test_worker_failure(self):
+        result = parallel.MapParallel(lambda x: lambda: x, n=2)(self.data)
+        self.assertListEqual([f() for f in result], list(self.data))
+
+        with self.assertRaises(RuntimeError):
+            list(parallel.MapParallel(os._exit, n=2)(self.data))
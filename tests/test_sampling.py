@@ -0,0 +1,74 @@
+from unittest import TestCase
+import random
+from collections import Counter
+
+import pipelib
+from pipelib import Dataset
+from pipelib import sampling
+
+
+class SamplingTestCase(TestCase):
+
+    def test_fenwick_tree(self):
+        rng = random.Random(0)
+        weights = [rng.choice([0, 0.5, 1, 3]) for _ in range(37)]
+        tree = sampling.FenwickTree(weights)
+
+        for _ in range(5):
+            prefix = [sum(weights[:i]) for i in range(len(weights) + 1)]
+            self.assertAlmostEqual(tree.total(), prefix[-1])
+            for _ in range(100):
+                u = rng.random() * prefix[-1]
+                i = tree.find(u)
+                self.assertLessEqual(prefix[i], u)
+                self.assertLess(u, prefix[i + 1])
+                self.assertGreater(weights[i], 0)
+            i = rng.randrange(len(weights))
+            tree.add(i, -weights[i])
+            weights[i] = 0
+            self.assertEqual(tree[i], 0)
+
+    def test_sample_from(self):
+        datasets = [Dataset(range(i * 1000, i * 1000 + 1000))
+                    for i in range(3)]
+        data = Dataset.sample_from(datasets, [1, 2, 5], seed=0)
+
+        self.assertEqual(len(data), 3000)
+        result = data.all()
+        self.assertListEqual(sorted(result), list(range(3000)))
+        self.assertListEqual(data.all(), result)
+        # each source keeps its order
+        for i in range(3):
+            self.assertListEqual([x for x in result if x // 1000 == i],
+                                 list(datasets[i]))
+
+        # the mixture follows the weights while all sources last
+        counts = Counter(x // 1000 for x in result[:1000])
+        self.assertGreater(counts[2], counts[1])
+        self.assertGreater(counts[1], counts[0])
+
+        prefetched = Dataset.sample_from(datasets, [1, 2, 5], seed=0,
+                                         n_prefetch=4)
+        self.assertListEqual(prefetched.all(), result)
+        self.assertListEqual(prefetched.take(10), result[:10])
+
+    def test_sample_from_many(self):
+        datasets = [Dataset(range(i)) for i in range(300)]
+        data = Dataset.sample_from(datasets, seed=1)
+        self.assertEqual(Counter(data), Counter(
+            x for i in range(300) for x in range(i)))
+
+        data = Dataset.sample_from([Dataset(range(3)), Dataset(range(3))],
+                                   [0, 1])
+        self.assertEqual(len(data), 3)
+        self.assertListEqual(data.all(), [0, 1, 2])
+
+        data = Dataset.sample_from([Dataset(range(3)).repeat(),
+                                    Dataset(range(3))])
+        self.assertEqual(data.cardinality(), pipelib.INFINITE)
+        self.assertEqual(len(data.take(100)), 100)
+
+        with self.assertRaises(ValueError):
+            Dataset.sample_from([Dataset(range(3))], [1, 2]).all()
+        with self.assertRaises(ValueError):
+            Dataset.sample_from([Dataset(range(3))], [0]).all()
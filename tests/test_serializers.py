@@ -1,5 +1,10 @@
 from unittest import TestCase
-from unittest.mock import patch, Mock
+from unittest.mock import patch
+import os
+import pickle
+import tempfile
+
+import cloudpickle
 
 from pipelib import serializers
 from pipelib import Dataset
@@ -10,30 +15,85 @@ class SerializersTestCase(TestCase):
         self.data = Dataset(range(100)) \
             .map(lambda x: x ** 2) \
             .map(lambda x: x / 2)
+        self.tempdir = tempfile.TemporaryDirectory()
+        self.filepath = f'{self.tempdir.name}/data'
+
+    def tearDown(self):
+        self.tempdir.cleanup()
+
+    def test_dump_load(self):
+        expected = list(range(100))
+        serializers.dump(expected, self.filepath)
+
+        self.assertListEqual(serializers.load(self.filepath), expected)
+        self.assertFalse(os.path.exists(
+            self.filepath + serializers.BUFFER_SUFFIX))
+
+    def test_dump_load_out_of_band(self):
+        if serializers.PROTOCOL < 5:
+            self.skipTest('pickle protocol 5 is not available')
+
+        chunks = [bytes(range(i, i + 100)) for i in range(10)]
+        serializers.dump(
+            [pickle.PickleBuffer(bytearray(x)) for x in chunks], self.filepath)
+
+        buffer_path = self.filepath + serializers.BUFFER_SUFFIX
+        self.assertTrue(os.path.exists(buffer_path))
+        with open(self.filepath, 'rb') as f:
+            self.assertNotIn(chunks[0], f.read())
 
-    @patch('pipelib.serializers.open')
-    @patch('pipelib.serializers.cloudpickle.dump')
-    def test_save_pipeline(self, cloudpickle_dump_mock, open_mock):
-        enter_mock = Mock()
-        open_mock.return_value.__enter__.return_value = enter_mock
+        result = serializers.load(self.filepath)
+        for x, y in zip(result, chunks):
+            self.assertIsInstance(x, memoryview)
+            self.assertEqual(x.tobytes(), y)
 
+        # stale buffers are removed when the new object has none
+        serializers.dump(list(range(10)), self.filepath)
+        self.assertFalse(os.path.exists(buffer_path))
+        self.assertListEqual(serializers.load(self.filepath), list(range(10)))
+
+    @patch('pipelib.serializers.dump')
+    def test_save_pipeline(self, dump_mock):
         filepath = '/path/to/pipeline'
         serializers.save_pipeline(filepath, self.data)
 
-        open_mock.assert_called_once_with(filepath, 'wb')
-        cloudpickle_dump_mock.assert_called_once_with(
-            self.data._func, enter_mock)
+        dump_mock.assert_called_once_with(
+            self.data._func, filepath, cloudpickle)
 
     @patch('pipelib.serializers.Path')
-    @patch('pipelib.serializers.cloudpickle.load')
-    def test_load_pipeline(self, cloudpickle_load_mock, PathMock):
-        cloudpickle_load_mock.return_value = self.data._func
-        enter_mock = Mock()
-        PathMock.return_value.open.return_value.__enter__.return_value = enter_mock
+    @patch('pipelib.serializers.load')
+    def test_load_pipeline(self, load_mock, PathMock):
+        load_mock.return_value = self.data._func
         filepath = '/path/to/pipeline'
         pipeline = serializers.load_pipeline(filepath)
 
         PathMock.assert_called_once_with(filepath)
-        PathMock.return_value.open.assert_called_once_with('rb')
-        cloudpickle_load_mock.assert_called_once_with(enter_mock)
+        load_mock.assert_called_once_with(
+            PathMock.return_value, cloudpickle)
         self.assertEqual(pipeline, self.data._func)
+
+    def test_save_load_pipeline(self):
+        serializers.save_pipeline(self.filepath, self.data)
+        pipeline = serializers.load_pipeline(self.filepath)
+
+        self.assertListEqual(
+            Dataset(range(100)).apply(pipeline).all(), self.data.all())
+
+    def test_dump_failure_keeps_previous(self):
+        if serializers.PROTOCOL < 5:
+            self.skipTest('pickle protocol 5 is not available')
+
+        class Unpicklable:
+            def __reduce__(self):
+                raise RuntimeError('cannot pickle')
+
+        expected = [pickle.PickleBuffer(bytearray(b'abc' * 10))]
+        serializers.dump(expected, self.filepath)
+        with self.assertRaises(RuntimeError):
+            serializers.dump([pickle.PickleBuffer(bytearray(b'xyz')),
+                              Unpicklable()], self.filepath)
+
+        result = serializers.load(self.filepath)
+        self.assertEqual(result[0].tobytes(), b'abc' * 10)
+        self.assertListEqual(sorted(os.listdir(self.tempdir.name)),
+                             ['data', 'data' + serializers.BUFFER_SUFFIX])
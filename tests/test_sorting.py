@@ -0,0 +1,51 @@
+from unittest import TestCase
+from unittest.mock import patch
+import random
+
+from pipelib import sorting
+
+
+class SortingTestCase(TestCase):
+
+    def setUp(self):
+        self.data = [(random.randrange(20), i) for i in range(1000)]
+
+    def check_sort(self, **kwargs):
+        for key in (None, lambda x: x[0]):
+            for reverse in (False, True):
+                result = sorting.external_sort(
+                    self.data, key, reverse, **kwargs)
+                expected = sorted(self.data, key=key, reverse=reverse)
+                self.assertListEqual(list(result), expected)
+
+    def test_in_memory(self):
+        self.check_sort()
+        self.check_sort(memory_limit=10 ** 9)
+
+    def test_spill(self):
+        with patch('pipelib.sorting._write_run',
+                   wraps=sorting._write_run) as write_run_mock:
+            self.check_sort(memory_limit=1000)
+        self.assertTrue(write_run_mock.called)
+
+    @patch('pipelib.sorting.MAX_RUNS', 3)
+    def test_multi_pass_merge(self):
+        self.check_sort(memory_limit=1000)
+
+        # one element per run: 1000 runs need ceil(log3(1000)) = 7 merge
+        # passes, each writing every element once more
+        n_written = 0
+        write_run = sorting._write_run
+
+        def count_write_run(pairs):
+            nonlocal n_written
+            pairs = list(pairs)
+            n_written += len(pairs)
+            return write_run(iter(pairs))
+
+        with patch('pipelib.sorting._write_run', count_write_run):
+            result = sorting.external_sort(
+                self.data, memory_limit=1, key=lambda x: x[0])
+            self.assertListEqual(
+                list(result), sorted(self.data, key=lambda x: x[0]))
+        self.assertLessEqual(n_written, len(self.data) * 8)